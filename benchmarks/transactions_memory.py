@@ -0,0 +1,81 @@
+"""
+Compare memory held by get_transactions results as tonlib dicts and as CompactTransaction records.
+
+    python benchmarks/transactions_memory.py [transactions_num]
+"""
+import base64
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pyTON.transaction_utils import CompactTransaction, json_default  # noqa: E402
+
+
+def random_address():
+    return base64.urlsafe_b64encode(os.urandom(36)).decode('utf-8')
+
+
+def random_message(source, destination):
+    return {
+        '@type': 'raw.message',
+        'source': source,
+        'destination': destination,
+        'value': str(random.randint(1, 10**12)),
+        'fwd_fee': str(random.randint(1, 10**7)),
+        'ihr_fee': '0',
+        'created_lt': str(random.randint(10**12, 10**13)),
+        'body_hash': base64.b64encode(os.urandom(32)).decode('utf-8'),
+        'message': base64.b64encode(os.urandom(random.randint(0, 40))).decode('utf-8')
+    }
+
+
+def random_transactions(n, account, counterparties):
+    # tonlib responses are parsed from json page by page, so equal strings are not shared between them
+    transactions = []
+    for i in range(n):
+        tx = {
+            '@type': 'raw.transaction',
+            'utime': 1600000000 + i,
+            'data': base64.b64encode(os.urandom(random.randint(300, 600))).decode('utf-8'),
+            'transaction_id': {
+                '@type': 'internal.transactionId',
+                'lt': str(10**13 - i),
+                'hash': base64.b64encode(os.urandom(32)).decode('utf-8')
+            },
+            'fee': str(random.randint(1, 10**7)),
+            'storage_fee': str(random.randint(1, 10**3)),
+            'other_fee': str(random.randint(1, 10**7)),
+            'in_msg': random_message(random.choice(counterparties), account),
+            'out_msgs': [random_message(account, random.choice(counterparties)) for _ in range(random.randint(0, 2))]
+        }
+        transactions.append(json.dumps(tx))
+    return transactions
+
+
+def measure(pages, build):
+    tracemalloc.start()
+    result = [build(json.loads(page)) for page in pages]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    random.seed(0)
+    account = random_address()
+    pages = random_transactions(n, account, [random_address() for _ in range(20)])
+    dicts, dicts_size = measure(pages, lambda tx: tx)
+    compact, compact_size = measure(pages, CompactTransaction)
+    assert json.dumps(compact, default=json_default) == json.dumps(dicts)
+    print('transactions:          %d' % n)
+    print('dicts:                 %.1f KiB' % (dicts_size / 1024))
+    print('CompactTransaction:    %.1f KiB (%.0f%%)' % (compact_size / 1024, 100 * compact_size / dicts_size))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,35 @@
-from .client import TonlibClient
-from .address_utils import detect_address as _detect_address, prepare_address as _prepare_address
+from .client import TonlibClient, b64_passthrough
+from .cache import LocalCache, SharedCache, config_namespace
+from .address_utils import detect_address as _detect_address
 from .wallet_utils import wallets as known_wallets, sha256
+from .transaction_utils import json_default, projection_fields, directions
+from .utils import TonLibWrongResult
+from .export_utils import encoders
+from .tracing import tracer, span, sample_stacks
 import json
 from aiohttp import web
-import base64, argparse, os, codecs
+import argparse, os
+import asyncio, signal
 
 import importlib.resources
 from tvm_valuetypes.cell import deserialize_cell_from_object
 import warnings, traceback
+import functools
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--port', '-p', default=8000, type=int)
     parser.add_argument('--getmethods', '-g', default=False, type=bool)
     parser.add_argument('--jsonrpc', '-j', default=True, type=bool)
+    parser.add_argument('--cache', '-c', default=None, choices=['local', 'shared'])
+    parser.add_argument('--cache-path', default=None)
+    parser.add_argument('--cache-slot-size', default=1024, type=int)
+    parser.add_argument('--prefetch', default=0, type=int)
+    parser.add_argument('--prefetch-budget', default=20, type=float)
+    parser.add_argument('--prefetch-jobs', default=1, type=int)
+    parser.add_argument('--prefetch-reserved-threads', default=2, type=int)
+    parser.add_argument('--config', default=None)
+    parser.add_argument('--admin', '-a', default=False, type=bool)
     args = parser.parse_args()
     port = args.port
     routes = web.RouteTableDef()
@@ -43,10 +59,30 @@ def main():
       }
 
 
+    def load_config():
+        if args.config is None:
+            return default_config
+        with open(args.config) as f:
+            return json.load(f)
+
     keystore= os.path.expanduser('ton_keystore')
     if not os.path.exists(keystore):
         os.makedirs(keystore)
-    tonlib = TonlibClient(default_config, keystore=keystore)
+    cache = None
+    if args.cache == 'local':
+        cache = LocalCache()
+    elif args.cache == 'shared':
+        cache = SharedCache(args.cache_path, slot_size=args.cache_slot_size, namespace=config_namespace(load_config()))
+    tonlib = TonlibClient(load_config(), keystore=keystore, cache=cache, prefetch_top=args.prefetch,
+                          prefetch_budget=args.prefetch_budget, prefetch_jobs=args.prefetch_jobs,
+                          prefetch_reserved_threads=args.prefetch_reserved_threads)
+
+    def reload_config():
+        try:
+            tonlib.reload_config(load_config())
+        except Exception:
+            warnings.warn("Can't reload config", RuntimeWarning)
+            traceback.print_exc()
 
     def detect_address(address):
         try:
@@ -56,17 +92,30 @@ def main():
 
     def prepare_address(address):
         try:
-            return _prepare_address(address)
+            with span('prepare_address'):
+                return tonlib.prepare_address(address)
         except:
             raise web.HTTPRequestRangeNotSatisfiable()
 
+    def b64_field(data, field, default=None):
+        value = data.get(field, default)
+        try:
+            return b64_passthrough(value)
+        except (TypeError, ValueError):
+            raise web.HTTPBadRequest(text = "Wrong base64 in %s" % field)
+
+    json_dumps = functools.partial(json.dumps, default=json_default)
+
     def wrap_result(func):
       cors_origin_header = ("Access-Control-Allow-Origin", "*")
       cors_headers_header = ("Access-Control-Allow-Headers", "*")
       headers = [cors_origin_header, cors_headers_header]
       async def wrapper(*args, **kwargs):
+        trace = tracer.start(getattr(args[0], 'path', func.__name__) if args else func.__name__)
         try:
-          return web.json_response( { "ok": True, "result": await func(*args, **kwargs) }, headers=headers)
+          result = await func(*args, **kwargs)
+          with span('encode_response'):
+            return web.json_response( { "ok": True, "result": result }, headers=headers, dumps=json_dumps)
         except Exception as e:
           try:
             return web.json_response( { "ok": False, "code": e.status_code,"error": str(e) }, headers=headers)
@@ -74,6 +123,8 @@ def main():
             warnings.warn("Unknown exception", SyntaxWarning)
             traceback.print_exc()
             return web.json_response( { "ok": False, "error": str(e) }, headers=headers)
+        finally:
+          tracer.finish(trace)
       return wrapper
 
     json_rpc_methods = {}
@@ -167,7 +218,88 @@ def main():
       tx_hash = request.query.get('hash', None)
       to_lt = request.query.get('to_lt', 0)
       to_lt = to_lt if not to_lt else int(to_lt)
-      return await tonlib.get_transactions(address, from_transaction_lt = lt, from_transaction_hash = tx_hash, to_transaction_lt = to_lt, limit = limit)
+      decode = str(request.query.get('decode', False)).lower() in ('1', 'true')
+      fields = request.query.get('fields', None)
+      if fields:
+        fields = fields.split(',') if isinstance(fields, str) else fields
+        if not set(fields) <= set(projection_fields):
+          raise web.HTTPBadRequest(text = "Unknown fields, supported are: %s" % ','.join(projection_fields))
+        if decode:
+          raise web.HTTPBadRequest(text = "fields can't be used with decode")
+      direction = request.query.get('direction', None)
+      if direction and direction not in directions:
+        raise web.HTTPBadRequest(text = "direction should be in or out")
+      min_value = request.query.get('min_value', None)
+      min_value = min_value if min_value is None else int(min_value)
+      paged = str(request.query.get('paged', False)).lower() in ('1', 'true')
+      if (direction or min_value is not None) and not paged:
+        raise web.HTTPBadRequest(text = "direction and min_value require paged=true, filtered scan is capped and returns where it stopped")
+      result, next_transaction_id = await tonlib.get_transactions(address, from_transaction_lt = lt, from_transaction_hash = tx_hash, to_transaction_lt = to_lt,
+                                                                  limit = limit, compact = not decode, fields = fields, direction = direction or None,
+                                                                  min_value = min_value, return_next = True)
+      if decode:
+        result = await tonlib.decode_transactions(result)
+      if paged:
+        return {'transactions': result, 'next_transaction_id': next_transaction_id}
+      return result
+
+    @routes.post('/getTransactionsFeed')
+    @json_rpc('getTransactionsFeed', 'post')
+    @wrap_result
+    async def get_transactions_feed(request):
+      data = await request.json()
+      limit = int(data.get('limit', 100))
+      if not 0 < limit <= 1000:
+        raise web.HTTPBadRequest(text = "limit should be from 1 to 1000")
+      cursor = data.get('cursor', None)
+      addresses = data.get('addresses', None)
+      if cursor is None:
+        if isinstance(addresses, dict):
+          try:
+            addresses = {a: None if p is None else (int(p['lt']), p['hash']) for a, p in addresses.items()}
+          except (TypeError, KeyError, ValueError):
+            raise web.HTTPBadRequest(text = "positions of addresses should be null or {lt, hash}")
+        elif not isinstance(addresses, list):
+          raise web.HTTPBadRequest(text = "addresses should be a list or a dict")
+        for a in addresses:
+          prepare_address(a)
+      try:
+        return await tonlib.get_merged_transactions(addresses, limit = limit, cursor = cursor)
+      except ValueError as e:
+        raise web.HTTPBadRequest(text = str(e))
+
+    @routes.get('/exportTransactions')
+    async def exportTransactions(request):
+      headers = [("Access-Control-Allow-Origin", "*"), ("Access-Control-Allow-Headers", "*")]
+      try:
+        address = prepare_address(request.query['address'])
+        export_format = request.query.get('format', 'ndjson')
+        if export_format not in encoders:
+          raise web.HTTPBadRequest(text = "format should be one of: %s" % ','.join(encoders))
+        lt = request.query.get('lt', None)
+        lt = lt if not lt else int(lt)
+        tx_hash = request.query.get('hash', None)
+        to_lt = int(request.query.get('to_lt', 0))
+        chunks = tonlib.export_transactions(address, export_format, from_transaction_lt = lt, from_transaction_hash = tx_hash, to_transaction_lt = to_lt)
+        first_chunk = await chunks.__anext__()
+      except Exception as e:
+        return web.json_response( { "ok": False, "code": getattr(e, 'status_code', None), "error": str(e) }, headers=headers)
+      response = web.StreamResponse(headers=dict(headers))
+      response.content_type = encoders[export_format].content_type
+      await response.prepare(request)
+      await response.write(first_chunk)
+      try:
+        async for chunk in chunks:
+          await response.write(chunk)
+      except Exception:
+        # headers are already sent: connection is dropped without the final chunk, so the client sees
+        # a broken stream instead of a complete export
+        traceback.print_exc()
+        if request.transport is not None:
+          request.transport.close()
+        return response
+      await response.write_eof()
+      return response
 
     @routes.get('/getAddressBalance')
     @json_rpc('getAddressBalance', 'get')
@@ -210,9 +342,30 @@ def main():
     @wrap_result
     async def send_boc(request):
       data = await request.json()
-      boc = base64.b64decode(data['boc'])
+      boc = b64_field(data, 'boc')
       return await tonlib.raw_send_message(boc)
 
+    @routes.post('/sendBocBatch')
+    @json_rpc('sendBocBatch', 'post')
+    @wrap_result
+    async def send_boc_batch(request):
+      data = await request.json()
+      bocs = data.get('bocs')
+      if not isinstance(bocs, list):
+        raise web.HTTPBadRequest(text = "bocs should be a list")
+      if len(bocs) > 1000:
+        raise web.HTTPBadRequest(text = "at most 1000 bocs in one batch")
+      result, valid_bocs, valid_idx = [None] * len(bocs), [], []
+      for i, boc in enumerate(bocs):
+        try:
+          valid_bocs.append(b64_passthrough(boc))
+          valid_idx.append(i)
+        except (TypeError, ValueError):
+          result[i] = {'status': 'error', 'error': 'Wrong base64'}
+      for i, status in zip(valid_idx, await tonlib.send_messages(valid_bocs)):
+        result[i] = status
+      return result
+
     @routes.post('/sendCellSimple')
     @json_rpc('sendCellSimple', 'post')
     @wrap_result
@@ -220,7 +373,7 @@ def main():
       data = await request.json()
       try:
         cell = deserialize_cell_from_object(data['cell'])
-        boc = codecs.encode(cell.serialize_boc(), 'base64')
+        boc = cell.serialize_boc()
       except:
         raise web.HTTPBadRequest(text = "Wrong cell object")
       return await tonlib.raw_send_message(boc)
@@ -231,10 +384,10 @@ def main():
     async def send_query(request):
       data = await request.json()
       address = prepare_address(data['address'])
-      body = codecs.decode(codecs.encode(data['body'], "utf-8"), 'base64').replace("\n",'') 
-      code = codecs.decode(codecs.encode(data.get('init_code', b''), "utf-8"), 'base64').replace("\n",'') 
-      data = codecs.decode(codecs.encode(data.query.get('init_data', b''), "utf-8"), 'base64').replace("\n",'')
-      return await tonlib.raw_create_and_send_query(address, body, init_code=code, init_data=data)
+      body = b64_field(data, 'body')
+      code = b64_field(data, 'init_code', '')
+      qdata = b64_field(data, 'init_data', '')
+      return await tonlib.raw_create_and_send_query(address, body, init_code=code, init_data=qdata)
 
     @routes.post('/sendQuerySimple')
     @json_rpc('sendQuerySimple', 'post')
@@ -253,19 +406,37 @@ def main():
         raise web.HTTPBadRequest(text = "Can't serialize cell object")
       return await tonlib.raw_create_and_send_query(address, body, init_code=qcode, init_data=qdata)
 
+    async def estimate_fees(address, messages):
+      try:
+        return await tonlib.estimate_fees(address, messages)
+      except TonLibWrongResult as e:
+        raise web.HTTPBadRequest(text = str(e))
+
+    def fee_message(data):
+      return {
+        'body': b64_field(data, 'body'),
+        'init_code': b64_field(data, 'init_code', ''),
+        'init_data': b64_field(data, 'init_data', ''),
+        'ignore_chksig': data.get('ignore_chksig', True)
+      }
+
     @routes.post('/estimateFee')
     @json_rpc('estimateFee', 'post')
     @wrap_result
     async def estimate_fee(request):
       data = await request.json()
       address = prepare_address(data['address'])
-      addr_info = await tonlib.raw_get_account_state(address)
-      assert address_state(addr_info)=='active'
-      body = codecs.decode(codecs.encode(data['body'], "utf-8"), 'base64').replace("\n",'') 
-      code = codecs.decode(codecs.encode(data.get('init_code', b''), "utf-8"), 'base64').replace("\n",'') 
-      data = codecs.decode(codecs.encode(data.get('init_data', b''), "utf-8"), 'base64').replace("\n",'')
-      ignore_chksig = data.get('ignore_chksig', True)
-      return await tonlib.raw_estimate_fees(address, body, init_code=code, init_data=data, ignore_chksig=ignore_chksig)
+      return (await estimate_fees(address, [fee_message(data)]))[0]
+
+    @routes.post('/estimateFeeBatch')
+    @json_rpc('estimateFeeBatch', 'post')
+    @wrap_result
+    async def estimate_fee_batch(request):
+      data = await request.json()
+      address = prepare_address(data['address'])
+      if not isinstance(data.get('messages'), list):
+        raise web.HTTPBadRequest(text = "messages should be a list")
+      return await estimate_fees(address, [fee_message(m) for m in data['messages']])
 
     @routes.post('/estimateFeeSimple')
     @json_rpc('estimateFeeSimple', 'post')
@@ -273,8 +444,6 @@ def main():
     async def estimate_fee_cell(request):
       data = await request.json()
       address = prepare_address(data['address'])
-      addr_info = await tonlib.raw_get_account_state(address)
-      assert address_state(addr_info)=='active'
       try:
         body = deserialize_cell_from_object(data['body']).serialize_boc(has_idx=False)
         qcode, qdata = b'', b''
@@ -285,7 +454,7 @@ def main():
         ignore_chksig = data.get('ignore_chksig', True)
       except:
         raise web.HTTPBadRequest(text = "Can't serialize cell object")
-      return await tonlib.raw_estimate_fees(address, body, init_code=qcode, init_data=qdata, ignore_chksig=ignore_chksig)
+      return (await estimate_fees(address, [{'body': body, 'init_code': qcode, 'init_data': qdata, 'ignore_chksig': ignore_chksig}]))[0]
 
     if args.getmethods:
         @routes.post('/runGetMethod')
@@ -297,6 +466,34 @@ def main():
           method = data['method']
           stack = data['stack']
           return await tonlib.raw_run_method(address, method, stack)
+    if args.admin:
+        @routes.post('/admin/reloadConfig')
+        @wrap_result
+        async def admin_reload_config(request):
+          tonlib.reload_config(load_config())
+          return "reloading"
+
+        tracer.enabled = True
+
+        @routes.get('/admin/traces')
+        @wrap_result
+        async def admin_traces(request):
+          try:
+            min_duration = float(request.query.get('min_duration', 0))
+          except ValueError:
+            raise web.HTTPBadRequest(text = "Wrong min_duration")
+          return tracer.traces(min_duration)
+
+        @routes.get('/admin/profile')
+        async def admin_profile(request):
+          try:
+            seconds = min(float(request.query.get('seconds', 10)), 300)
+            interval = max(float(request.query.get('interval', 0.005)), 0.001)
+          except ValueError:
+            raise web.HTTPBadRequest(text = "Wrong seconds or interval")
+          # sampler sleeps between samples in its own thread, tonlib threads are not occupied
+          stacks = await asyncio.get_event_loop().run_in_executor(None, sample_stacks, seconds, interval)
+          return web.Response(text=stacks, content_type='text/plain')
     if args.jsonrpc:
         @routes.post('/jsonRPC')
         async def jsonrpc_handler(request):
@@ -319,6 +516,12 @@ def main():
 
     app = web.Application()
     app.add_routes(routes)
+    async def start_prefetcher(app):
+      tonlib.start_prefetcher()
+    app.on_startup.append(start_prefetcher)
+    async def reload_on_sighup(app):
+      asyncio.get_event_loop().add_signal_handler(signal.SIGHUP, reload_config)
+    app.on_startup.append(reload_on_sighup)
     def cors_handler(*args, **kwargs):
       cors_origin_header = ("Access-Control-Allow-Origin", "*")
       cors_headers_header = ("Access-Control-Allow-Headers", "*")
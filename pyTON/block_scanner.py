@@ -0,0 +1,197 @@
+import asyncio
+import json
+import os
+
+from .client import b64str_hex
+from .utils import TonLibWrongResult
+
+master_workchain, master_shard = -1, -9223372036854775808
+
+
+class _MasterBlockDone:
+    __slots__ = ('seqno',)
+
+    def __init__(self, seqno):
+        self.seqno = seqno
+
+
+class BlockScanner:
+    """
+    Stream of all transactions on chain, masterchain block by masterchain block:
+
+        scanner = BlockScanner(tonlib, checkpoint_path='scanner.json')
+        async for tx in scanner:
+            ...
+
+    For every masterchain block scanner resolves shard blocks committed since the previous masterchain block
+    and lists their transactions. Up to `prefetch_blocks` masterchain blocks are processed ahead concurrently
+    and tonlib calls are limited by `concurrency`, so they are spread over tonlib instances of the client.
+    Transactions are yielded in masterchain block order through a queue of `queue_size` items: when consumer
+    is slow, scanning waits. Seqno of masterchain block is remembered (and written to checkpoint file if it
+    is set) after all its transactions are consumed, after an error or a restart scanning resumes from the
+    next one.
+
+    Yielded transactions are raw.transaction dicts with additional 'account' (raw address) and 'block'
+    (ton.blockIdExt) fields, or blocks.shortTxId dicts with the same fields if full_transactions is False.
+    """
+    def __init__(self, client, start_seqno=None, checkpoint_path=None, prefetch_blocks=4, concurrency=16,
+                 queue_size=1000, full_transactions=True, poll_interval=1, retries=3):
+        self._client = client
+        self._start_seqno = start_seqno
+        self._checkpoint_path = checkpoint_path
+        self._prefetch_blocks = prefetch_blocks
+        self._concurrency = concurrency
+        self._queue_size = queue_size
+        self._full_transactions = full_transactions
+        self._poll_interval = poll_interval
+        self._retries = retries
+        self._queue = None
+        self._semaphore = None
+        self._producer = None
+        self._tops = {}
+        self._consumed_seqno = None
+
+    def _load_checkpoint(self):
+        if self._consumed_seqno is not None:
+            return self._consumed_seqno
+        if self._checkpoint_path and os.path.exists(self._checkpoint_path):
+            with open(self._checkpoint_path) as f:
+                return json.load(f)['seqno']
+        return None
+
+    def _save_checkpoint(self, seqno):
+        if not self._checkpoint_path:
+            return
+        tmp_path = self._checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'seqno': seqno}, f)
+        os.replace(tmp_path, self._checkpoint_path)
+
+    async def _call(self, f, *args):
+        for attempt in range(self._retries + 1):
+            async with self._semaphore:
+                r = await f(*args)
+            if not (isinstance(r, dict) and r.get('@type') == 'error'):
+                return r
+            if attempt < self._retries:
+                await asyncio.sleep(self._poll_interval)
+        raise TonLibWrongResult(r.get('message', "Can't get %s" % f.__name__))
+
+    async def _shard_tops_of(self, seqno):
+        master = await self._call(self._client.lookup_block, master_workchain, master_shard, seqno)
+        shards = await self._call(self._client.get_shards, master)
+        return master, shards['shards']
+
+    def _shard_tops(self, seqno):
+        if seqno not in self._tops:
+            self._tops[seqno] = asyncio.ensure_future(self._shard_tops_of(seqno))
+        return self._tops[seqno]
+
+    async def _new_shard_blocks(self, tops, prev_tops):
+        """
+        Walk back from shard tops of masterchain block until shard blocks known to the previous one.
+        """
+        known = {(b['workchain'], b['shard'], b['seqno']) for b in prev_tops}
+        min_seqno = {}
+        for b in prev_tops:
+            min_seqno[b['workchain']] = min(b['seqno'], min_seqno.get(b['workchain'], b['seqno']))
+        result, visited, level = [], set(), list(tops)
+        while level:
+            new_blocks = []
+            for b in level:
+                key = (b['workchain'], b['shard'], b['seqno'])
+                if key in known or key in visited or b['seqno'] <= min_seqno.get(b['workchain'], -1):
+                    continue
+                visited.add(key)
+                new_blocks.append(b)
+            result.extend(new_blocks)
+            # blocks of workchains unknown to the previous masterchain block are not walked back
+            walk = [b for b in new_blocks if b['workchain'] in min_seqno]
+            headers = await asyncio.gather(*[self._call(self._client.get_block_header, b) for b in walk])
+            level = [prev for h in headers for prev in h.get('prev_blocks', [])]
+        return sorted(result, key=lambda b: (b['workchain'], b['seqno'], b['shard']))
+
+    async def _block_transactions(self, block):
+        transactions, after = [], ()
+        while True:
+            r = await self._call(self._client.get_block_transactions, block, 40, *after)
+            transactions.extend(r['transactions'])
+            if not r.get('incomplete') or not r['transactions']:
+                return transactions
+            last = r['transactions'][-1]
+            after = (last['account'], last['lt'])
+
+    async def _transaction(self, block, short_tx):
+        account = '%d:%s' % (block['workchain'], b64str_hex(short_tx['account']))
+        if self._full_transactions:
+            tx = await self._call(self._client.get_transaction, account, short_tx['lt'], b64str_hex(short_tx['hash']))
+        else:
+            tx = short_tx
+        return dict(tx, account=account, block=block)
+
+    async def _scan_master_block(self, seqno):
+        (master, tops), (_, prev_tops) = await asyncio.gather(self._shard_tops(seqno), self._shard_tops(seqno - 1))
+        blocks = [master] + await self._new_shard_blocks(tops, prev_tops)
+        short_txs = await asyncio.gather(*[self._block_transactions(b) for b in blocks])
+        return await asyncio.gather(*[self._transaction(b, tx) for b, txs in zip(blocks, short_txs) for tx in txs])
+
+    async def _produce(self):
+        pending = {}
+        try:
+            checkpoint = self._load_checkpoint()
+            if checkpoint is not None:
+                seqno = checkpoint + 1
+            elif self._start_seqno is not None:
+                seqno = self._start_seqno
+            else:
+                seqno = (await self._call(self._client.get_masterchain_info))['last']['seqno']
+            scheduled = seqno
+            while True:
+                last = (await self._call(self._client.get_masterchain_info))['last']['seqno']
+                while seqno <= last:
+                    while scheduled <= last and scheduled - seqno < self._prefetch_blocks:
+                        pending[scheduled] = asyncio.ensure_future(self._scan_master_block(scheduled))
+                        scheduled += 1
+                    transactions = await pending.pop(seqno)
+                    self._tops.pop(seqno - 1, None)
+                    for tx in transactions:
+                        await self._queue.put(tx)
+                    await self._queue.put(_MasterBlockDone(seqno))
+                    seqno += 1
+                await asyncio.sleep(self._poll_interval)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # failed lookups are retried when the next producer resumes from the checkpoint
+            self._tops = {k: f for k, f in self._tops.items() if not f.done() or (not f.cancelled() and f.exception() is None)}
+            await self._queue.put(e)
+        finally:
+            for task in pending.values():
+                task.cancel()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._producer is None:
+            self._queue = asyncio.Queue(maxsize=self._queue_size)
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+            self._producer = asyncio.ensure_future(self._produce())
+        while True:
+            item = await self._queue.get()
+            if isinstance(item, _MasterBlockDone):
+                self._consumed_seqno = item.seqno
+                self._save_checkpoint(item.seqno)
+                continue
+            if isinstance(item, Exception):
+                self._producer = None
+                raise item
+            return item
+
+    def stop(self):
+        if self._producer is not None:
+            self._producer.cancel()
+            self._producer = None
+        for task in self._tops.values():
+            task.cancel()
+        self._tops = {}
@@ -0,0 +1,201 @@
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class LocalCache:
+    """
+    In-process LRU cache with per-key TTL.
+    """
+    def __init__(self, max_size=100000):
+        self._max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires is not None and expires < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = None if ttl is None else time.time() + ttl
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self._max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+def config_namespace(config):
+    """
+    Short id of the network of tonlib config (hash of its zero state), so caches of different networks don't mix
+    """
+    zero_state = config.get('validator', {}).get('zero_state', {})
+    return hashlib.sha256(str(zero_state.get('root_hash', '')).encode('utf-8')).hexdigest()[:16]
+
+
+class SharedCache:
+    """
+    Cache shared by all processes on the host which open the same file: set-associative hash table in
+    mmap'ed file (in /dev/shm by default), values are stored as JSON.
+
+    Every key hash maps to a bucket of `ways` slots. Readers are lock-free: each bucket has a sequence
+    counter which writers make odd while the bucket is modified, readers retry if the counter changed during
+    the read. Writers are serialized with flock on the file. When bucket is full, the victim is chosen by
+    clock (second chance) algorithm among its slots.
+
+    Keys are hashed together with `namespace` (see config_namespace) and the default file name includes it,
+    so instances connected to different networks never share entries. Values longer than `slot_size` bytes
+    of JSON are not stored.
+    """
+    _magic = b'pyTONc01'
+    _header = struct.Struct('<8sIII')        # magic, buckets, ways, slot_size
+    _bucket_header = struct.Struct('<QI4x')  # seq, clock hand
+    _slot_header = struct.Struct('<QdBI3x')  # key hash, expires, referenced, value length
+    _ref_offset = 16
+
+    def __init__(self, path=None, slots=65536, ways=8, slot_size=1024, namespace=''):
+        if path is None:
+            name = 'pyTON-cache-' + namespace if namespace else 'pyTON-cache'
+            path = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), name)
+        self._path = path
+        self._namespace = namespace + '\x00' if namespace else ''
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size == 0:
+                self._buckets, self._ways, self._slot_size = max(slots // ways, 1), ways, slot_size
+                os.ftruncate(self._fd, self._file_size())
+                os.pwrite(self._fd, self._header.pack(self._magic, self._buckets, self._ways, self._slot_size), 0)
+            else:
+                magic, self._buckets, self._ways, self._slot_size = self._header.unpack(os.pread(self._fd, self._header.size, 0))
+                if magic != self._magic or os.fstat(self._fd).st_size != self._file_size():
+                    raise ValueError("%s is not a pyTON cache file" % path)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._mm = mmap.mmap(self._fd, self._file_size())
+
+    def _slot_total(self):
+        return self._slot_header.size + self._slot_size
+
+    def _bucket_total(self):
+        return self._bucket_header.size + self._ways * self._slot_total()
+
+    def _file_size(self):
+        return self._header.size + self._buckets * self._bucket_total()
+
+    def _key_hash(self, key):
+        h = int.from_bytes(hashlib.blake2b((self._namespace + key).encode('utf-8'), digest_size=8).digest(), 'little')
+        return h or 1  # 0 marks empty slot
+
+    def _bucket_offset(self, key_hash):
+        return self._header.size + (key_hash % self._buckets) * self._bucket_total()
+
+    def _slot_offset(self, bucket_offset, i):
+        return bucket_offset + self._bucket_header.size + i * self._slot_total()
+
+    def get(self, key):
+        key_hash = self._key_hash(key)
+        bucket = self._bucket_offset(key_hash)
+        for _ in range(16):
+            seq, _hand = self._bucket_header.unpack_from(self._mm, bucket)
+            if seq & 1:
+                continue
+            found, payload, expires = False, None, None
+            for i in range(self._ways):
+                slot = self._slot_offset(bucket, i)
+                slot_hash, expires, _ref, length = self._slot_header.unpack_from(self._mm, slot)
+                if slot_hash == key_hash:
+                    start = slot + self._slot_header.size
+                    found, payload = True, self._mm[start:start + length]
+                    break
+            if self._bucket_header.unpack_from(self._mm, bucket)[0] != seq:
+                continue
+            if not found or (expires and expires < time.time()):
+                return None
+            # benign race with writers: reference bit is only a hint for eviction
+            self._mm[slot + self._ref_offset] = 1
+            try:
+                return json.loads(payload)
+            except ValueError:
+                return None
+        return None
+
+    def _write(self, bucket, update):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                seq, hand = self._bucket_header.unpack_from(self._mm, bucket)
+                self._bucket_header.pack_into(self._mm, bucket, seq + 1, hand)
+                try:
+                    hand = update(hand)
+                finally:
+                    self._bucket_header.pack_into(self._mm, bucket, seq + 2, hand)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def set(self, key, value, ttl=None):
+        payload = json.dumps(value).encode('utf-8')
+        if len(payload) > self._slot_size:
+            return
+        key_hash = self._key_hash(key)
+        bucket = self._bucket_offset(key_hash)
+        expires = 0.0 if ttl is None else time.time() + ttl
+
+        def update(hand):
+            now, target = time.time(), None
+            slots = [self._slot_header.unpack_from(self._mm, self._slot_offset(bucket, i)) for i in range(self._ways)]
+            for i, (slot_hash, slot_expires, _ref, _length) in enumerate(slots):
+                if slot_hash == key_hash:
+                    target = i
+                    break
+                if target is None and (slot_hash == 0 or (slot_expires and slot_expires < now)):
+                    target = i
+            while target is None:
+                slot = self._slot_offset(bucket, hand)
+                if self._mm[slot + self._ref_offset]:
+                    self._mm[slot + self._ref_offset] = 0
+                else:
+                    target = hand
+                hand = (hand + 1) % self._ways
+            slot = self._slot_offset(bucket, target)
+            start = slot + self._slot_header.size
+            self._mm[start:start + len(payload)] = payload
+            self._slot_header.pack_into(self._mm, slot, key_hash, expires, 0, len(payload))
+            return hand
+        self._write(bucket, update)
+
+    def delete(self, key):
+        key_hash = self._key_hash(key)
+        bucket = self._bucket_offset(key_hash)
+
+        def update(hand):
+            for i in range(self._ways):
+                slot = self._slot_offset(bucket, i)
+                if self._slot_header.unpack_from(self._mm, slot)[0] == key_hash:
+                    self._slot_header.pack_into(self._mm, slot, 0, 0.0, 0, 0)
+            return hand
+        self._write(bucket, update)
+
+    def close(self):
+        self._mm.close()
+        os.close(self._fd)
@@ -1,23 +1,58 @@
 # -*- coding: utf-8 -*-
 import asyncio
+import base64
 import codecs
+import heapq
+import multiprocessing
+import re
 import struct
 import socket
-from concurrent.futures import ThreadPoolExecutor
+import time
+import zlib
+from collections import OrderedDict, deque
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import threading
+import traceback
+import warnings
 from datetime import datetime, timezone
+from hashlib import sha256
 
 import json
 from .tonlibjson import TonWrapper
 from .address_utils import prepare_address
+from .transaction_utils import decode_transactions, CompactTransaction, transaction_filter, project_transaction
+from .utils import TonLibWrongResult
+from .cache import LocalCache
+from .prefetcher import Prefetcher
+from .export_utils import encoders
+from .wallet_pipeline import WalletPipeline
+from .lifecycle import InstanceManager
+from .tracing import current_trace, run_traced, span
 from tvm_valuetypes import serialize_tvm_stack, render_tvm_stack
+from tvm_valuetypes.cell import deserialize_boc
 import functools
 
 def parallelize(f):
     @functools.wraps(f)
     def wrapper(self, *args, **kwds):
-        loop = asyncio.get_event_loop()
-        return loop.run_in_executor(self._executor, functools.partial(f, self, *args, **kwds))
+        trace = current_trace.get()
+        if trace is not None:
+            job = functools.partial(run_traced, trace, time.perf_counter(), self._run_in_worker, f, self, *args, **kwds)
+        else:
+            job = functools.partial(self._run_in_worker, f, self, *args, **kwds)
+        if self._style == 'asyncio':
+            self._inflight += 1
+            future = asyncio.get_event_loop().run_in_executor(self._executor, job)
+            future.add_done_callback(self._job_done)
+            return future
+        if self._style == 'futures':
+            with self._lock:
+                self._inflight += 1
+            future = self._executor.submit(job)
+            future.add_done_callback(self._job_done_locked)
+            return future
+        raise RuntimeError(self._style)
     return wrapper
 
 
@@ -35,6 +70,45 @@ def b64str_hex(b64str):
 def h2b64(x):
  return codecs.encode(codecs.decode(x, 'hex'), 'base64').decode().replace("\n", "")
 
+_b64_re = re.compile(r'(?:[A-Za-z0-9+/]{4})*(?:[A-Za-z0-9+/]{2}==|[A-Za-z0-9+/]{3}=)?')
+_b64_bytes_re = re.compile(_b64_re.pattern.encode())
+
+class b64str(str):
+  """
+    str which is already valid base64 and is put into tonlib requests as is
+  """
+  __slots__ = ()
+
+def b64_passthrough(data):
+  """
+    Validate already base64-encoded data once and mark it for passing to tonlib without re-encoding.
+    :param data: str, bytes, bytearray or memoryview with base64 text
+    :return: b64str
+  """
+  if isinstance(data, b64str):
+    return data
+  if not isinstance(data, str):
+    data = memoryview(data)
+    if _b64_bytes_re.fullmatch(data):
+      return b64str(str(data, 'ascii'))
+    data = str(data, 'ascii')
+  elif _b64_re.fullmatch(data):
+    return b64str(data)
+  # slow path for base64 split into lines
+  data = ''.join(data.split())
+  if not _b64_re.fullmatch(data):
+    raise ValueError("Invalid base64 data")
+  return b64str(data)
+
+def to_b64(data):
+  """
+    Convert tonlib `bytes` argument to base64 str.
+    :param data: b64str (passed as is) or raw bytes-like object
+  """
+  if isinstance(data, b64str):
+    return data
+  return base64.b64encode(data).decode('ascii')
+
 
 class TonlibClient:
     _t_local = threading.local()
@@ -44,18 +118,220 @@ class TonlibClient:
             self,
             config,
             keystore,
-            threads=10
+            threads=10,
+            dedup_window=60,
+            decode_processes=None,
+            decode_chunk_size=32,
+            decoded_cache_size=100000,
+            fees_cache_size=10000,
+            cache=None,
+            account_state_ttl=2,
+            run_method_ttl=2,
+            prefetch_top=0,
+            prefetch_budget=20,
+            prefetch_jobs=1,
+            prefetch_reserved_threads=2,
+            max_loaded_contracts=300,
+            invalid_address_cache_size=10000,
+            empty_account_cache_size=10000,
+            empty_account_ttl=10,
+            style='asyncio'
     ):
+        """
+        :param style: 'asyncio' - methods return asyncio futures and should be called from the event loop thread,
+            'futures' - methods return concurrent.futures.Future and may be called from any thread, so the client
+            can be embedded into synchronous services. Async generators, decode_transactions, wallet_pipeline
+            and the prefetcher are available in asyncio style only.
+        """
+        self._style = style
+        self._threads = threads
+        self._inflight = 0
+        self._decode_processes = decode_processes
+        self._decode_executor = None
+        self._decode_chunk_size = decode_chunk_size
+        self._decoded_cache_size = decoded_cache_size
+        self._decoded_transactions = OrderedDict()
+        self._fees_cache_size = fees_cache_size
+        self._fees_cache = OrderedDict()
+        self._cache = cache
+        self._account_state_ttl = account_state_ttl
+        self._run_method_ttl = run_method_ttl
+        # separate caches, so floods of distinct malformed addresses don't evict empty accounts
+        self._invalid_addresses = LocalCache(invalid_address_cache_size)
+        self._empty_accounts = LocalCache(empty_account_cache_size)
+        self._empty_account_ttl = empty_account_ttl
+        self._last_sync_utime = 0
+        self._prefetcher = None
+        self._wallet_pipeline = None
+        if prefetch_top:
+          if self._cache is None:
+            self._cache = LocalCache()
+          self._prefetcher = Prefetcher(self, top=prefetch_top, budget=prefetch_budget, jobs=prefetch_jobs,
+                                       reserved_threads=prefetch_reserved_threads)
+        self._lock = threading.Lock()
+        self._dedup_window = dedup_window
+        self._sent_messages = OrderedDict()
+        (self.config, self.keystore) = config, keystore
+        self._workers = {}
+        self._max_loaded_contracts = max_loaded_contracts
+        self._instance_manager = InstanceManager(self, max_loaded_contracts=max_loaded_contracts)
+        self._standby = {}
+        self._config_generation = 0
+        self._reloads = 0
         self._executor = ThreadPoolExecutor(
             max_workers = threads,
-            initializer = self.init_tonlib_thread,
-            initargs = (config, keystore)
+            initializer = self._init_worker
         )
 
+    def _job_done(self, future):
+        self._inflight -= 1
+
+    def _job_done_locked(self, future):
+        with self._lock:
+          self._inflight -= 1
+
+    def _chunks(self, items):
+        """
+        Split items into at most one chunk per tonlib thread
+        """
+        if not items:
+          return []
+        chunk_size = -(-len(items) // self._threads)
+        return [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+    def _merge_chunks(self, futures, finish=None):
+        """
+        Future of the client style with concatenated results of chunk futures, passed through finish if it is set
+        """
+        finish = finish or (lambda results: results)
+        if self._style == 'asyncio':
+          async def merge():
+            return finish([r for chunk in await asyncio.gather(*futures) for r in chunk])
+          return asyncio.ensure_future(merge())
+        merged = concurrent.futures.Future()
+        pending = [len(futures)]
+        def chunk_done(_):
+          with self._lock:
+            pending[0] -= 1
+            if pending[0]:
+              return
+          try:
+            merged.set_result(finish([r for f in futures for r in f.result()]))
+          except Exception as e:
+            merged.set_exception(e)
+        if not futures:
+          merged.set_result(finish([]))
+        for f in futures:
+          f.add_done_callback(chunk_done)
+        return merged
+
+    def start_prefetcher(self):
+        """
+        Start refreshing account states of hot addresses in background, should be called from running event loop
+        """
+        if self._prefetcher is not None:
+          self._prefetcher.start()
+
+    @property
+    def wallet_pipeline(self):
+        """
+        WalletPipeline for sending messages of wallets with local seqno tracking and confirmation watching
+        """
+        if self._wallet_pipeline is None:
+          self._wallet_pipeline = WalletPipeline(self)
+        return self._wallet_pipeline
+
     def reload_tonlib(self):
       self.init_tonlib_thread(self.config, self.keystore)
 
+    def _init_worker(self):
+        self.init_tonlib_thread(self.config, self.keystore)
+        self._instance_manager.start()
+
+    def _run_in_worker(self, f, *args, **kwds):
+        if self._standby:
+          generation, standby = self._standby.pop(threading.get_ident(), (None, None))
+          if generation != self._config_generation:
+            # created for the config which is replaced already
+            self._instance_manager.retire(standby)
+          elif standby is not None:
+            # previous wrapper is idle now, it is destroyed by the instance manager thread, not on request path
+            self._instance_manager.retire(getattr(self._t_local, 'tonlib_wrapper', None))
+            self._t_local.tonlib_wrapper = standby
+            self._workers[threading.get_ident()] = standby
+        return f(*args, **kwds)
+
+    def reload_config(self, config):
+        """
+        Switch to new config without restart: new tonlib instances for every worker thread are initialized
+        and synced in background thread, each worker swaps to its new instance before its next request, so
+        in-flight requests finish on old instances. Client caches are kept. If any instance fails to initialize
+        or sync with the new config, the reload is aborted and the old config stays in use. When reloads
+        overlap, only the latest one is applied.
+        :return: background thread
+        """
+        with self._lock:
+          self._reloads += 1
+          reload_id = self._reloads
+        def roll():
+          created = {}
+          try:
+            for ident in list(self._workers):
+              created[ident] = self._create_standby(config)
+            with self._lock:
+              if reload_id != self._reloads:
+                return
+              self._config_generation += 1
+              self.config = config
+              for ident, wrapper in created.items():
+                wrapper.config_generation = self._config_generation
+                self._instance_manager.retire(self._standby.get(ident, (None, None))[1])
+                self._standby[ident] = (self._config_generation, wrapper)
+              generation, created = self._config_generation, {}
+            # workers started during the reload were initialized with the old config
+            for ident in list(self._workers):
+              if self._workers[ident].config_generation != generation and ident not in self._standby:
+                self._park_standby(ident, generation, self._create_standby(config))
+          except Exception:
+            warnings.warn("Config reload failed, old config is kept", RuntimeWarning)
+            traceback.print_exc()
+          finally:
+            for wrapper in created.values():
+              self._instance_manager.retire(wrapper)
+        thread = threading.Thread(target=roll, name='pyTON-reload-config', daemon=True)
+        thread.start()
+        return thread
+
+    def _park_standby(self, ident, generation, wrapper):
+        """
+        Park wrapper created for the config of `generation` as standby of the worker, unless the config was
+        reloaded meanwhile or the worker has a standby already
+        """
+        wrapper.config_generation = generation
+        with self._lock:
+          if generation == self._config_generation and ident not in self._standby:
+            self._standby[ident] = (generation, wrapper)
+            return
+        self._instance_manager.retire(wrapper)
+
+    def _create_standby(self, config):
+        """
+        Initialized tonlib instance which is already synced with liteserver, so the first request swapped to it
+        does not wait for the sync
+        """
+        tonlib_wrapper = self._create_tonlib_wrapper(config, self.keystore)
+        r = tonlib_wrapper.ton_exec({'@type': 'sync'})
+        if r.get('@type') == 'error':
+          raise TonLibWrongResult(r.get('message', "Can't sync tonlib instance"))
+        return tonlib_wrapper
+
     def init_tonlib_thread(self, config, keystore):
+        (self.config, self.keystore) = config, keystore
+        self._t_local.tonlib_wrapper = self._create_tonlib_wrapper(config, keystore)
+        self._t_local.tonlib_wrapper.config_generation = self._config_generation
+        self._workers[threading.get_ident()] = self._t_local.tonlib_wrapper
+
+    def _create_tonlib_wrapper(self, config, keystore):
         """
         TL Spec
             init options:options = options.Info;
@@ -67,11 +343,9 @@ class TonlibClient:
         :param ip: IPv4 address in dotted notation or signed int32
         :param port: IPv4 TCP port
         :param key: base64 pub key of liteserver node
-        :return: None
+        :return: initialized TonWrapper
         """
-        (self.config, self.keystore) = config, keystore
-        self._t_local.loaded_contracts_num = 0
-        self._t_local.tonlib_wrapper = TonWrapper()
+        tonlib_wrapper = TonWrapper()
         liteservers = config["liteservers"]
         fixed_ip_liteservers = []
         for ls in liteservers:
@@ -106,8 +380,14 @@ class TonlibClient:
             }
         }
 
-        self._t_local.tonlib_wrapper.ton_exec(data)
-        self.set_verbosity_level(0)
+        r = tonlib_wrapper.ton_exec(data)
+        if r.get('@type') == 'error':
+          raise TonLibWrongResult(r.get('message', "Can't initialize tonlib"))
+        tonlib_wrapper.ton_exec({
+            '@type': 'setLogVerbosityLevel',
+            'new_verbosity_level': 0
+            })
+        return tonlib_wrapper
 
     def set_verbosity_level(self, level):
         data = {
@@ -117,6 +397,30 @@ class TonlibClient:
         r = self._t_local.tonlib_wrapper.ton_exec(data)
         return r
 
+    def prepare_address(self, address):
+      """
+        address_utils.prepare_address, cached in the client cache if it is set. Parse failures are remembered
+        in the negative cache, so repeated invalid addresses are rejected without decoding them again.
+      """
+      if self._cache is not None:
+        r = self._cache.get('address:' + address)
+        if r is not None:
+          return r
+      negative_key = 'invalid:' + address if isinstance(address, str) and len(address) <= 256 else None
+      if negative_key is not None:
+        failure = self._invalid_addresses.get(negative_key)
+        if failure is not None:
+          raise failure[0](*failure[1])
+      try:
+        r = prepare_address(address)
+      except Exception as e:
+        if negative_key is not None:
+          self._invalid_addresses.set(negative_key, (type(e), e.args))
+        raise
+      if self._cache is not None:
+        self._cache.set('address:' + address, r)
+      return r
+
     def _raw_get_transactions(self, account_address: str, from_transaction_lt: str, from_transaction_hash: str):
         """
         TL Spec:
@@ -147,7 +451,7 @@ class TonlibClient:
                 'previous_transaction_id': internal.transactionId
             }
         """
-        account_address = prepare_address(account_address)
+        account_address = self.prepare_address(account_address)
         from_transaction_hash = h2b64(from_transaction_hash)
 
         data = {
@@ -170,24 +474,43 @@ class TonlibClient:
 
     @parallelize
     def get_transactions(self, account_address, from_transaction_lt=None, from_transaction_hash=None,
-                                                to_transaction_lt=0, limit = 1000):
+                                                to_transaction_lt=0, limit = 1000, compact=False,
+                                                fields=None, direction=None, min_value=None, scan_limit=10000,
+                                                return_next=False):
       """
        Return all transactions between from_transaction_lt and to_transaction_lt
        if to_transaction_lt and to_transaction_hash are not defined returns all transactions
        if from_transaction_lt and from_transaction_hash are not defined checks last
+       if compact is True returns transaction_utils.CompactTransaction objects instead of dicts,
+       they are serializable with json.dumps(..., default=transaction_utils.json_default)
+       direction and min_value filter transactions (see transaction_utils.transaction_filter) and fields
+       selects transaction_utils.projection_fields of the rest while pages are fetched, limit counts only
+       transactions which pass the filter; with a filter the scan stops after scan_limit transactions
+       (rounded up to the page) even if less than limit of them passed
+       if return_next is True returns tuple (transactions, next_transaction_id) where next_transaction_id is
+       {'lt': int, 'hash': hex str} of the first transaction which was not scanned, to continue from it, or
+       None if the history is scanned down to to_transaction_lt
       """
+      check = transaction_filter(direction, min_value)
       if (from_transaction_lt==None) or (from_transaction_hash==None):
         addr = self._raw_get_account_state(account_address)
         try:
           from_transaction_lt, from_transaction_hash = int(addr["last_transaction_id"]["lt"]), b64str_hex(addr["last_transaction_id"]["hash"])
         except KeyError:
-          return []
+          return ([], None) if return_next else []
       reach_lt = False
       all_transactions = []
+      scanned = 0
+      next_transaction_id = None
       current_lt, curret_hash = from_transaction_lt, from_transaction_hash
       while (not reach_lt) and (len(all_transactions)<limit):
+        if check and scanned >= scan_limit:
+          next_transaction_id = {'lt': current_lt, 'hash': curret_hash}
+          break
+        next_transaction_id = None
         raw_transactions = self._raw_get_transactions(account_address, current_lt, curret_hash)
         if(raw_transactions['@type']) == 'error':
+          next_transaction_id = {'lt': current_lt, 'hash': curret_hash}
           break
           #TODO probably we should chenge get_transactions API
           #if 'message' in raw_transactions['message']:
@@ -195,26 +518,225 @@ class TonlibClient:
           #else:
           #  raise Exception("Can't get transactions")
         transactions, next = raw_transactions['transactions'], raw_transactions.get("previous_transaction_id", None)
+        scanned += len(transactions)
         for t in transactions:
           tlt = int(t['transaction_id']['lt'])
           if tlt <= to_transaction_lt:
             reach_lt = True
             break
-          all_transactions.append(t)
+          if check and not check(t):
+            continue
+          if fields:
+            all_transactions.append(project_transaction(t, fields, direction, min_value))
+          else:
+            all_transactions.append(CompactTransaction(t) if compact else t)
         if next:
           current_lt, curret_hash = int(next["lt"]), b64str_hex(next["hash"])
         else:
           break
         if current_lt==0:
           break
-      return all_transactions
+        if not reach_lt:
+          next_transaction_id = {'lt': current_lt, 'hash': curret_hash}
+      if reach_lt:
+        next_transaction_id = None
+      return (all_transactions, next_transaction_id) if return_next else all_transactions
 
-    def _raw_get_account_state(self, address: str):
+    async def iter_transactions(self, account_address, from_transaction_lt=None, from_transaction_hash=None,
+                                                to_transaction_lt=0):
+      """
+        Async generator of transaction pages (lists of raw.transaction dicts) from from_transaction_lt down to
+        to_transaction_lt, see get_transactions. Only one page is held at a time.
+        Raises TonLibWrongResult if account state or transactions can't be fetched.
+      """
+      if (from_transaction_lt==None) or (from_transaction_hash==None):
+        addr = await self.raw_get_account_state(account_address)
+        if addr.get('@type') == 'error':
+          raise TonLibWrongResult(addr.get('message', "Can't get account state"))
+        try:
+          from_transaction_lt, from_transaction_hash = int(addr["last_transaction_id"]["lt"]), b64str_hex(addr["last_transaction_id"]["hash"])
+        except KeyError:
+          return
+      current_lt, current_hash = from_transaction_lt, from_transaction_hash
+      while current_lt:
+        raw_transactions = await self.raw_get_transactions(account_address, current_lt, current_hash)
+        if raw_transactions['@type'] == 'error':
+          raise TonLibWrongResult(raw_transactions.get('message', "Can't get transactions"))
+        page = []
+        for t in raw_transactions['transactions']:
+          if int(t['transaction_id']['lt']) <= to_transaction_lt:
+            yield page
+            return
+          page.append(t)
+        yield page
+        next = raw_transactions.get("previous_transaction_id", None)
+        if not next:
+          return
+        current_lt, current_hash = int(next["lt"]), b64str_hex(next["hash"])
+
+    async def export_transactions(self, account_address, format='ndjson', from_transaction_lt=None, from_transaction_hash=None,
+                                                to_transaction_lt=0):
+      """
+        Async generator of bytes with account history encoded by export_utils encoder (ndjson or arrow),
+        every chunk is produced as soon as the page of transactions is fetched. The first chunk is produced
+        after the first page is fetched, so errors of account state or the first page are raised before any
+        output.
+      """
+      encoder = encoders[format]()
+      header = encoder.header()
+      async for page in self.iter_transactions(account_address, from_transaction_lt, from_transaction_hash, to_transaction_lt):
+        yield header + encoder.encode(page)
+        header = b''
+      yield header + encoder.footer()
+
+    @staticmethod
+    def _encode_feed_cursor(positions):
+      data = json.dumps({a: [lt, tx_hash, utime] for a, (lt, tx_hash, utime) in positions.items()}, separators=(',', ':'))
+      return base64.urlsafe_b64encode(zlib.compress(data.encode())).decode('ascii')
+
+    @staticmethod
+    def _decode_feed_cursor(cursor):
+      try:
+        data = json.loads(zlib.decompress(base64.urlsafe_b64decode(cursor)))
+        return {a: (int(lt), str(tx_hash), None if utime is None else int(utime)) for a, (lt, tx_hash, utime) in data.items()}
+      except Exception:
+        raise ValueError("Wrong cursor")
+
+    async def get_merged_transactions(self, addresses=None, limit=100, cursor=None):
+      """
+        One feed of transactions of many accounts, newest first, k-way merged by (utime, lt) with a heap.
+
+        Every account is in the heap with its next transaction: either the head of its fetched page, or the
+        position of the next page with an upper bound of its utime (utime of the previous transaction, stored
+        in the cursor). Pages are fetched only for accounts which reach the top of the heap, concurrently for
+        all such accounts among the top `limit` entries, so a call with a cursor fetches at most about `limit`
+        pages whatever the number of accounts. Only the current page of every account is held in memory.
+
+        :param addresses: list of addresses to start from their last transactions, or dict
+          {address: (lt, hex hash) or None} with per-address positions
+        :param limit: max number of transactions in result
+        :param cursor: str returned by the previous call, continues the same feed, addresses are taken from it
+        :return: dict as {
+            'transactions': list of raw.transaction dicts with additional 'account' field,
+            'cursor': str or None if all histories are exhausted
+          }
+      """
+      # positions: start of the next page not fetched yet as (lt, hex hash, utime bound or None if unknown)
+      if cursor is not None:
+        positions = self._decode_feed_cursor(cursor)
+      else:
+        if not isinstance(addresses, dict):
+          addresses = dict.fromkeys(addresses)
+        positions = {}
+        for a, p in addresses.items():
+          positions[self.prepare_address(a)] = None if p is None else (int(p[0]), p[1], None)
+        latest = [a for a, p in positions.items() if p is None]
+        for address, state in zip(latest, await self.get_account_states(latest)):
+          if state.get('@type') == 'error':
+            raise TonLibWrongResult(state.get('message', "Can't get state of %s" % address))
+          tx_id = state.get('last_transaction_id') or {}
+          if int(tx_id.get('lt', 0)):
+            # last transaction is not newer than the state
+            positions[address] = (int(tx_id['lt']), b64str_hex(tx_id['hash']), state.get('sync_utime'))
+          else:
+            # no transactions at all
+            del positions[address]
+
+      async def fetch(address):
+        lt, tx_hash, utime = positions[address]
+        r = await self.raw_get_transactions(address, lt, tx_hash)
+        if r.get('@type') == 'error':
+          raise TonLibWrongResult(r.get('message', "Can't get transactions of %s" % address))
+        page = deque(r['transactions'])
+        prev = r.get('previous_transaction_id')
+        if page and prev and int(prev['lt']):
+          positions[address] = (int(prev['lt']), b64str_hex(prev['hash']), page[-1]['utime'])
+        else:
+          del positions[address]
+        return page
+
+      heap, pages = [], {}
+      def push(address):
+        page = pages.get(address)
+        if page:
+          heapq.heappush(heap, (-page[0]['utime'], -int(page[0]['transaction_id']['lt']), address))
+        elif address in positions:
+          lt, _, utime = positions[address]
+          heapq.heappush(heap, (-utime if utime is not None else -float('inf'), -lt, address))
+
+      for address in positions:
+        push(address)
+      transactions = []
+      while heap and len(transactions) < limit:
+        if not pages.get(heap[0][2]):
+          # accounts among the top entries without fetched page are fetched together, each of them has at
+          # least one transaction which may get into the result
+          top = [heapq.heappop(heap)[2] for _ in range(min(limit - len(transactions), len(heap)))]
+          missing = [a for a in top if not pages.get(a)]
+          for address, page in zip(missing, await asyncio.gather(*[fetch(a) for a in missing])):
+            pages[address] = page
+          for address in top:
+            push(address)
+          continue
+        _, _, address = heapq.heappop(heap)
+        transactions.append(dict(pages[address].popleft(), account=address))
+        push(address)
+
+      next_positions = {}
+      for address in set(pages) | set(positions):
+        page = pages.get(address)
+        if page:
+          tx_id = page[0]['transaction_id']
+          next_positions[address] = (int(tx_id['lt']), b64str_hex(tx_id['hash']), page[0]['utime'])
+        elif address in positions:
+          next_positions[address] = positions[address]
+      return {
+        'transactions': transactions,
+        'cursor': self._encode_feed_cursor(next_positions) if next_positions else None
+      }
+
+    async def decode_transactions(self, transactions):
+      """
+        Parse transaction data, op codes and text comments of messages in a process pool, see
+        transaction_utils.decode_transaction. Results are cached by transaction hash.
+        :param transactions: list of raw.transaction dicts
+        :return: list of decoded transactions in the same order
+      """
+      if self._decode_executor is None:
+        # fork of the process running tonlib and executor threads may deadlock in the child,
+        # workers are started from a clean forkserver process, they need transaction_utils only
+        self._decode_executor = ProcessPoolExecutor(max_workers = self._decode_processes,
+                                                    mp_context = multiprocessing.get_context('forkserver'))
+      decoded, missed = [], []
+      for i, tx in enumerate(transactions):
+        tx_hash = tx['transaction_id']['hash']
+        cached = self._decoded_transactions.get(tx_hash)
+        if cached is not None:
+          self._decoded_transactions.move_to_end(tx_hash)
+        else:
+          missed.append(i)
+        decoded.append(cached)
+      loop = asyncio.get_event_loop()
+      chunks = [missed[i:i + self._decode_chunk_size] for i in range(0, len(missed), self._decode_chunk_size)]
+      results = await asyncio.gather(*[
+        loop.run_in_executor(self._decode_executor, decode_transactions, [transactions[i] for i in chunk])
+        for chunk in chunks])
+      for chunk, chunk_result in zip(chunks, results):
+        for i, tx in zip(chunk, chunk_result):
+          decoded[i] = tx
+          self._decoded_transactions[tx['transaction_id']['hash']] = tx
+      while len(self._decoded_transactions) > self._decoded_cache_size:
+        self._decoded_transactions.popitem(last=False)
+      return decoded
+
+    def _raw_get_account_state(self, address: str, use_cache=True):
         """
         TL Spec:
             raw.getAccountState account_address:accountAddress = raw.AccountState;
             accountAddress account_address:string = AccountAddress;
         :param address: str with raw or user friendly address
+        :param use_cache: return state from the client cache if it is not older than account_state_ttl, states of
+            uninitialized accounts are kept in the negative cache for empty_account_ttl until a newer block is seen
         :return: dict as
             {
                 '@type': 'raw.accountState',
@@ -225,25 +747,85 @@ class TonlibClient:
                 'sync_utime': int
             }
         """
-        account_address = prepare_address(address)
+        account_address = self.prepare_address(address)
+        cache_key = 'account_state:' + account_address
+        if use_cache and self._cache is not None:
+          r = self._cache.get(cache_key)
+          if r is not None:
+            return dict(r)
+        empty_key = 'empty_account:' + account_address
+        if use_cache:
+          r = self._empty_accounts.get(empty_key)
+          if r is not None and r.get('sync_utime', 0) >= self._last_sync_utime:
+            return dict(r)
 
         data = {
             '@type': 'raw.getAccountState',
             'account_address': {
-                'account_address': address
+                'account_address': account_address
             }
         }
 
         r = self._t_local.tonlib_wrapper.ton_exec(data)
+        if r.get('@type') == 'error':
+          return r
+        sync_utime = r.get('sync_utime', 0)
+        if sync_utime > self._last_sync_utime:
+          # state from a new block: negative entries of older blocks are not valid anymore
+          self._last_sync_utime = sync_utime
+        if not r.get('code') and not r.get('data') and not r.get('frozen_hash'):
+          self._empty_accounts.set(empty_key, r, self._empty_account_ttl)
+          r = dict(r)
+        else:
+          self._empty_accounts.delete(empty_key)
+        if self._cache is not None:
+          self._cache.set(cache_key, r, self._account_state_ttl)
+          r = dict(r)
         return r
 
     @parallelize
-    def raw_get_account_state(self, address: str):
-      return self._raw_get_account_state(address)
+    def raw_get_account_state(self, address: str, use_cache=True):
+      if self._prefetcher is not None:
+        self._prefetcher.touch(self.prepare_address(address))
+      return self._raw_get_account_state(address, use_cache)
+
+    @parallelize
+    def _refresh_account_states(self, addresses):
+      for address in addresses:
+        try:
+          self._raw_get_account_state(address, use_cache=False)
+        except Exception:
+          pass
+
+    @parallelize
+    def _raw_get_account_states(self, addresses, use_cache=True):
+      states = []
+      for address in addresses:
+        try:
+          states.append(self._raw_get_account_state(address, use_cache))
+        except Exception as e:
+          states.append({'@type': 'error', 'message': str(e)})
+      return states
+
+    def get_account_states(self, addresses, use_cache=True):
+      """
+        raw_get_account_state for many addresses at once: addresses are split into one chunk per tonlib
+        thread and every chunk is a single executor job.
+
+        :return: future of list of raw.accountState dicts in the same order as addresses, failed ones are
+          {'@type': 'error', 'message': str}
+      """
+      if self._prefetcher is not None:
+        for address in addresses:
+          try:
+            self._prefetcher.touch(self.prepare_address(address))
+          except Exception:
+            pass
+      return self._merge_chunks([self._raw_get_account_states(chunk, use_cache) for chunk in self._chunks(list(addresses))])
 
     @parallelize
     def generic_get_account_state(self, address: str):
-        account_address = prepare_address(address)
+        account_address = self.prepare_address(address)
         data = {
             '@type': 'generic.getAccountState',
             'account_address': {
@@ -253,10 +835,128 @@ class TonlibClient:
         r = self._t_local.tonlib_wrapper.ton_exec(data)
         return r
 
+    def _raw_get_masterchain_info(self):
+      """
+        TL Spec:
+          blocks.getMasterchainInfo = blocks.MasterchainInfo;
+          blocks.masterchainInfo last:ton.BlockIdExt state_root_hash:bytes init:ton.BlockIdExt = blocks.MasterchainInfo;
+          ton.blockIdExt workchain:int32 shard:int64 seqno:int32 root_hash:bytes file_hash:bytes = ton.BlockIdExt;
+      """
+      data = {
+        '@type': 'blocks.getMasterchainInfo'
+      }
+      r = self._t_local.tonlib_wrapper.ton_exec(data)
+      return r
+
+    @parallelize
+    def get_masterchain_info(self):
+      return self._raw_get_masterchain_info()
+
+    @parallelize
+    def lookup_block(self, workchain, shard, seqno=None, lt=None, unixtime=None):
+      """
+        TL Spec:
+          blocks.lookupBlock mode:int32 id:ton.blockId lt:int64 utime:int32 = ton.BlockIdExt;
+          ton.blockId workchain:int32 shard:int64 seqno:int32 = internal.BlockId;
+        :param workchain, shard: shard to look in
+        :param seqno, lt, unixtime: exactly one of them should be defined
+        :return: ton.blockIdExt dict
+      """
+      mode = (1 if seqno is not None else 0) | (2 if lt is not None else 0) | (4 if unixtime is not None else 0)
+      data = {
+        '@type': 'blocks.lookupBlock',
+        'mode': mode,
+        'id': {
+          '@type': 'ton.blockId',
+          'workchain': workchain,
+          'shard': shard,
+          'seqno': seqno or 0
+        },
+        'lt': lt or 0,
+        'utime': unixtime or 0
+      }
+      r = self._t_local.tonlib_wrapper.ton_exec(data)
+      return r
+
+    @parallelize
+    def get_shards(self, master_block):
+      """
+        TL Spec:
+          blocks.getShards id:ton.blockIdExt = blocks.Shards;
+          blocks.shards shards:vector<ton.BlockIdExt> = blocks.Shards;
+        :param master_block: ton.blockIdExt dict of masterchain block
+      """
+      data = {
+        '@type': 'blocks.getShards',
+        'id': master_block
+      }
+      r = self._t_local.tonlib_wrapper.ton_exec(data)
+      return r
+
+    @parallelize
+    def get_block_header(self, block):
+      """
+        TL Spec:
+          blocks.getBlockHeader id:ton.blockIdExt = blocks.Header;
+        :param block: ton.blockIdExt dict
+        :return: blocks.header dict, prev_blocks field contains ids of previous blocks
+      """
+      data = {
+        '@type': 'blocks.getBlockHeader',
+        'id': block
+      }
+      r = self._t_local.tonlib_wrapper.ton_exec(data)
+      return r
+
+    @parallelize
+    def get_block_transactions(self, block, count=40, after_account=None, after_lt=None):
+      """
+        TL Spec:
+          blocks.getTransactions id:ton.blockIdExt mode:# count:# after:blocks.accountTransactionId = blocks.Transactions;
+          blocks.accountTransactionId account:bytes lt:int64 = blocks.AccountTransactionId;
+          blocks.shortTxId mode:# account:mode.0?bytes lt:mode.1?int64 hash:mode.2?bytes = liteServer.TransactionId;
+          blocks.transactions id:ton.blockIdExt req_count:int32 incomplete:Bool transactions:vector<blocks.shortTxId> = blocks.Transactions;
+        :param block: ton.blockIdExt dict
+        :param after_account: base64 account id (as in blocks.shortTxId) of transaction to continue after
+        :param after_lt: lt of transaction to continue after
+      """
+      mode = 7
+      if after_account is not None:
+        mode |= 128
+      data = {
+        '@type': 'blocks.getTransactions',
+        'id': block,
+        'mode': mode,
+        'count': count,
+        'after': {
+          '@type': 'blocks.accountTransactionId',
+          'account': after_account or 'AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA=',
+          'lt': after_lt or 0
+        }
+      }
+      r = self._t_local.tonlib_wrapper.ton_exec(data)
+      return r
+
+    @parallelize
+    def get_transaction(self, account_address, lt, tx_hash):
+      """
+        Single transaction by its id, see _raw_get_transactions
+        :param tx_hash: transaction hash in HEX representation
+        :return: raw.transaction dict or tonlib error
+      """
+      r = self._raw_get_transactions(account_address, lt, tx_hash)
+      if r.get('@type') == 'error':
+        return r
+      for t in r['transactions']:
+        if int(t['transaction_id']['lt']) == int(lt):
+          return t
+      return {'@type': 'error', 'code': 404, 'message': 'transaction not found'}
+
     def _load_contract(self, address):
-        if(self._t_local.loaded_contracts_num > 300):
+        if(self._t_local.tonlib_wrapper.loaded_contracts_num > 2 * self._max_loaded_contracts):
+          # instance manager should have replaced this instance already
           self.reload_tonlib()
-        account_address = prepare_address(address)
+        account_address = self.prepare_address(address)
         data = {
               '@type': 'smc.load',
                'account_address': {
@@ -264,10 +964,10 @@ class TonlibClient:
               }
         }  
         r = self._t_local.tonlib_wrapper.ton_exec(data)
-        self._t_local.loaded_contracts_num += 1
+        self._t_local.tonlib_wrapper.loaded_contracts_num += 1
         return r["id"]    
 
-    def _raw_run_method(self, address, method, stack_data, output_layout=None):
+    def _raw_run_method(self, address, method, stack_data, output_layout=None, use_cache=True):
       """
         For numeric data only
         TL Spec:
@@ -291,6 +991,11 @@ class TonlibClient:
         
         smc.runResult gas_used:int53 stack:vector<tvm.StackEntry> exit_code:int32 = smc.RunResult;
       """
+      if self._cache is not None:
+        cache_key = 'run_method:%s:%s:%s' % (self.prepare_address(address), method, json.dumps(stack_data, sort_keys=True))
+        r = self._cache.get(cache_key) if use_cache else None
+        if r is not None:
+          return dict(r)
       stack_data = render_tvm_stack(stack_data)
       if isinstance(method, int):
         method = { '@type': 'smc.methodIdNumber', 'number': method}
@@ -305,31 +1010,138 @@ class TonlibClient:
       }      
       r = self._t_local.tonlib_wrapper.ton_exec(data)
       if 'stack' in r:
-        r['stack'] = serialize_tvm_stack(r['stack'])
+        with span('serialize_tvm_stack'):
+          r['stack'] = serialize_tvm_stack(r['stack'])
       if '@type' in r and r['@type'] == 'smc.runResult':
         r.pop('@type')
+        if self._cache is not None:
+          self._cache.set(cache_key, r, self._run_method_ttl)
+          r = dict(r)
       return r
       
     @parallelize
-    def raw_run_method(self, address, method, stack_data, output_layout=None):
-      return self._raw_run_method(address, method, stack_data, output_layout)
+    def raw_run_method(self, address, method, stack_data, output_layout=None, use_cache=True):
+      return self._raw_run_method(address, method, stack_data, output_layout, use_cache)
       
 
-    @parallelize
-    def raw_send_message(self, serialized_boc):
+    def _raw_send_message(self, serialized_boc):
       """
         raw.sendMessage body:bytes = Ok;
 
-        :param serialized_boc: bytes, serialized bag of cell
+        :param serialized_boc: bytes, serialized bag of cell, or b64str with already encoded one
       """
-      serialized_boc = codecs.decode(codecs.encode(serialized_boc, "base64"), 'utf-8').replace("\n",'')
+      serialized_boc = to_b64(serialized_boc)
       data = {
         '@type': 'raw.sendMessage',
         'body': serialized_boc
       }
       r = self._t_local.tonlib_wrapper.ton_exec(data)
       return r
-      
+
+    @parallelize
+    def _raw_run_methods(self, calls, use_cache=True):
+      results = []
+      for call in calls:
+        try:
+          results.append(self._raw_run_method(*call, use_cache=use_cache))
+        except Exception as e:
+          results.append({'@type': 'error', 'message': str(e)})
+      return results
+
+    def run_methods(self, calls, use_cache=True):
+      """
+        raw_run_method for many calls at once, split into one executor job per tonlib thread.
+
+        :param calls: list of tuples (address, method, stack_data) or (address, method, stack_data, output_layout)
+        :return: future of list of results in the same order as calls, failed ones are
+          {'@type': 'error', 'message': str}
+      """
+      return self._merge_chunks([self._raw_run_methods(chunk, use_cache) for chunk in self._chunks(list(calls))])
+
+    @parallelize
+    def raw_send_message(self, serialized_boc):
+      return self._raw_send_message(serialized_boc)
+
+    def _message_hash(self, serialized_boc):
+      if isinstance(serialized_boc, b64str):
+        serialized_boc = base64.b64decode(serialized_boc)
+      serialized_boc = bytes(serialized_boc)
+      try:
+        return deserialize_boc(serialized_boc).hash()
+      except Exception:
+        # not a single-root boc, tonlib will decide; dedup by raw bytes
+        return sha256(serialized_boc).digest()
+
+    def _remember_message(self, msg_hash):
+      """
+        Returns False if message with the same hash was sent within dedup window
+      """
+      now = time.monotonic()
+      with self._lock:
+        while self._sent_messages:
+          sent_at = next(iter(self._sent_messages.values()))
+          if now - sent_at < self._dedup_window:
+            break
+          self._sent_messages.popitem(last=False)
+        if msg_hash in self._sent_messages:
+          return False
+        self._sent_messages[msg_hash] = now
+        return True
+
+    def _forget_message(self, msg_hash):
+      with self._lock:
+        self._sent_messages.pop(msg_hash, None)
+
+    @parallelize
+    def _raw_send_messages(self, serialized_bocs):
+      statuses = []
+      for boc in serialized_bocs:
+        msg_hash = self._message_hash(boc)
+        status = {'hash': msg_hash.hex()}
+        if not self._remember_message(msg_hash):
+          status['status'] = 'duplicate'
+        else:
+          try:
+            r = self._raw_send_message(boc)
+          except Exception as e:
+            r = {'@type': 'error', 'message': str(e)}
+          if r.get('@type') == 'error':
+            self._forget_message(msg_hash)
+            status['status'] = 'error'
+            status['error'] = r.get('message', '')
+          else:
+            status['status'] = 'sent'
+        statuses.append(status)
+      return statuses
+
+    def send_messages(self, serialized_bocs):
+      """
+        Send many messages at once. Messages are split into chunks which are sent concurrently by different
+        tonlib instances, messages with the same cell hash sent within `dedup_window` seconds are dropped.
+        Copies of a message within the batch get 'error' status of the copy which was sent and failed instead
+        of 'duplicate'. A message which is being sent by another concurrent call is reported as 'duplicate'
+        even if that send fails later.
+
+        :param serialized_bocs: list of bytes or b64str
+        :return: future of list of dicts as {'hash': hex str, 'status': 'sent'|'duplicate'|'error', 'error': str}
+          in the same order as serialized_bocs
+      """
+      chunks = [self._raw_send_messages(chunk) for chunk in self._chunks(serialized_bocs)]
+      return self._merge_chunks(chunks, self._fix_batch_duplicates)
+
+    @staticmethod
+    def _fix_batch_duplicates(statuses):
+      sent, failed = set(), {}
+      for status in statuses:
+        if status['status'] == 'sent':
+          sent.add(status['hash'])
+        elif status['status'] == 'error':
+          failed.setdefault(status['hash'], status)
+      for status in statuses:
+        if status['status'] == 'duplicate' and status['hash'] in failed and status['hash'] not in sent:
+          status['status'], status['error'] = 'error', failed[status['hash']]['error']
+      return statuses
+
     def _raw_create_query(self, destination, body, init_code=b'', init_data=b''):
       """
         raw.createQuery destination:accountAddress init_code:bytes init_data:bytes body:bytes = query.Info;
@@ -337,10 +1149,10 @@ class TonlibClient:
         query.info id:int53 valid_until:int53 body_hash:bytes  = query.Info;
 
       """
-      init_code = codecs.decode(codecs.encode(init_code, "base64"), 'utf-8').replace("\n",'')
-      init_data = codecs.decode(codecs.encode(init_data, "base64"), 'utf-8').replace("\n",'')
-      body = codecs.decode(codecs.encode(body, "base64"), 'utf-8').replace("\n",'')
-      destination = prepare_address(destination)
+      init_code = to_b64(init_code)
+      init_data = to_b64(init_data)
+      body = to_b64(body)
+      destination = self.prepare_address(destination)
       data = {
         '@type': 'raw.createQuery',
         'body': body,
@@ -377,9 +1189,9 @@ class TonlibClient:
         raw.createAndSendMessage destination:accountAddress initial_account_state:bytes data:bytes = Ok;
         
       """
-      initial_account_state = codecs.decode(codecs.encode(initial_account_state, "base64"), 'utf-8').replace("\n",'')
-      body = codecs.decode(codecs.encode(body, "base64"), 'utf-8').replace("\n",'')
-      destination = prepare_address(destination)
+      initial_account_state = to_b64(initial_account_state)
+      body = to_b64(body)
+      destination = self.prepare_address(destination)
       data = {
         '@type': 'raw.createAndSendMessage',
         'destination': {
@@ -392,13 +1204,79 @@ class TonlibClient:
       return r
       #return ('@type' in r) and (r['@type']=="Ok")
 
-    @parallelize
-    def raw_estimate_fees(self, destination, body, init_code=b'', init_data=b'', ignore_chksig=True):
+    def _raw_forget_query(self, query_info):
+      """
+        query.forget id:int53 = Ok;
+      """
+      data = {
+        '@type': 'query.forget',
+        'id': query_info['id']
+      }
+      r = self._t_local.tonlib_wrapper.ton_exec(data)
+      return r
+
+    def _raw_estimate_fees(self, destination, body, init_code=b'', init_data=b'', ignore_chksig=True):
+      """
+        query.estimateFees id:int53 ignore_chksig:Bool = query.Fees;
+      """
       query_info = self._raw_create_query(destination, body, init_code, init_data)
+      if query_info.get('@type') == 'error':
+        return query_info
       data = {
         '@type': 'query.estimateFees',
         'id': query_info['id'],
         'ignore_chksig': ignore_chksig
       }
       r = self._t_local.tonlib_wrapper.ton_exec(data)
+      self._raw_forget_query(query_info)
       return r
+
+    @parallelize
+    def raw_estimate_fees(self, destination, body, init_code=b'', init_data=b'', ignore_chksig=True):
+      return self._raw_estimate_fees(destination, body, init_code, init_data, ignore_chksig)
+
+    def _fees_cache_key(self, destination, account_state, body, init_code, init_data, ignore_chksig):
+      h = sha256()
+      for x in (body, init_code, init_data):
+        h.update(to_b64(x).encode('ascii'))
+        h.update(b'|')
+      h.update(b'1' if ignore_chksig else b'0')
+      last_tx = account_state.get('last_transaction_id', {})
+      return (destination, last_tx.get('lt'), last_tx.get('hash'), h.digest())
+
+    @parallelize
+    def estimate_fees(self, destination, messages, only_active=True):
+      """
+        Estimate fees of many messages to one destination in one call. Destination state is fetched once,
+        it is used to check that account is active and as a part of the cache key, so cached fees are
+        reused until the next transaction of the destination.
+
+        :param destination: str with raw or user friendly address
+        :param messages: list of dicts as {'body': bytes or b64str, 'init_code': ..., 'init_data': ..., 'ignore_chksig': bool}
+        :param only_active: raise TonLibWrongResult if destination is not active
+        :return: list of query.fees dicts (or tonlib errors) in the same order as messages
+      """
+      destination = self.prepare_address(destination)
+      account_state = self._raw_get_account_state(destination)
+      if account_state.get('@type') == 'error':
+        raise TonLibWrongResult(account_state.get('message', "Can't get account state"))
+      if only_active and len(account_state.get('code', '')) == 0:
+        raise TonLibWrongResult("Destination account is not active")
+      results = []
+      for msg in messages:
+        body, init_code, init_data = msg['body'], msg.get('init_code', b''), msg.get('init_data', b'')
+        ignore_chksig = msg.get('ignore_chksig', True)
+        key = self._fees_cache_key(destination, account_state, body, init_code, init_data, ignore_chksig)
+        with self._lock:
+          r = self._fees_cache.get(key)
+          if r is not None:
+            self._fees_cache.move_to_end(key)
+        if r is None:
+          r = self._raw_estimate_fees(destination, body, init_code, init_data, ignore_chksig)
+          if r.get('@type') != 'error':
+            with self._lock:
+              self._fees_cache[key] = r
+              while len(self._fees_cache) > self._fees_cache_size:
+                self._fees_cache.popitem(last=False)
+        results.append(r)
+      return results
@@ -0,0 +1,75 @@
+import io
+import json
+
+from .transaction_utils import flat_transaction
+
+
+class NdjsonEncoder:
+    """
+    One raw.transaction JSON per line.
+    """
+    content_type = 'application/x-ndjson'
+
+    def header(self):
+        return b''
+
+    def encode(self, transactions):
+        return b''.join(json.dumps(tx).encode('utf-8') + b'\n' for tx in transactions)
+
+    def footer(self):
+        return b''
+
+
+class ArrowEncoder:
+    """
+    Apache Arrow IPC stream with one record batch of transaction_utils.flat_transaction rows per page.
+    Requires pyarrow.
+    """
+    content_type = 'application/vnd.apache.arrow.stream'
+
+    def __init__(self):
+        try:
+            import pyarrow
+        except ImportError:
+            raise RuntimeError("pyarrow is required for arrow export")
+        self._pa = pyarrow
+        self._schema = pyarrow.schema([
+            ('lt', pyarrow.int64()),
+            ('hash', pyarrow.string()),
+            ('utime', pyarrow.int64()),
+            ('fee', pyarrow.int64()),
+            ('storage_fee', pyarrow.int64()),
+            ('other_fee', pyarrow.int64()),
+            ('source', pyarrow.string()),
+            ('destination', pyarrow.string()),
+            ('value', pyarrow.int64()),
+            ('out_msgs_count', pyarrow.int32()),
+            ('out_value', pyarrow.int64())
+        ])
+        self._sink = io.BytesIO()
+        self._writer = None
+
+    def _flush(self):
+        data = self._sink.getvalue()
+        self._sink.seek(0)
+        self._sink.truncate()
+        return data
+
+    def header(self):
+        self._writer = self._pa.ipc.new_stream(self._sink, self._schema)
+        return self._flush()
+
+    def encode(self, transactions):
+        rows = [flat_transaction(tx) for tx in transactions]
+        if not rows:
+            return b''
+        columns = [self._pa.array([row[field.name] for row in rows], type=field.type) for field in self._schema]
+        self._writer.write_batch(self._pa.RecordBatch.from_arrays(columns, schema=self._schema))
+        return self._flush()
+
+    def footer(self):
+        self._writer.close()
+        return self._flush()
+
+
+encoders = {'ndjson': NdjsonEncoder, 'arrow': ArrowEncoder}
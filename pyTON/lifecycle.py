@@ -0,0 +1,115 @@
+import os
+import resource
+import sys
+import threading
+import time
+import traceback
+import warnings
+
+
+def process_rss():
+    """
+    Current resident set size of the process in bytes
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # peak RSS: kilobytes on linux, bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class InstanceManager:
+    """
+    Recycles tonlib instances of client worker threads in background thread.
+
+    Instance is replaced when it is older than `max_age` seconds, loaded more than `max_loaded_contracts`
+    contracts, or more than `max_error_rate` of its last requests (at least `min_requests` of them) failed.
+    When RSS of the process grew by `max_rss_growth` bytes the oldest instance is replaced. Replacement is
+    initialized and synced here and parked as standby of the worker, worker swaps to it before its next request
+    and hands the old instance back, it is destroyed here on the next check.
+    """
+    def __init__(self, client, check_interval=5, max_age=6 * 3600, max_loaded_contracts=300,
+                 max_error_rate=0.5, min_requests=20, max_rss_growth=512 * 2**20):
+        self._client = client
+        self._check_interval = check_interval
+        self._max_age = max_age
+        self._max_loaded_contracts = max_loaded_contracts
+        self._max_error_rate = max_error_rate
+        self._min_requests = min_requests
+        self._max_rss_growth = max_rss_growth
+        self._rss_baseline = None
+        self._last_counters = {}
+        self._retired = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='pyTON-instance-manager', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def retire(self, wrapper):
+        """
+        Keep replaced instance until the next check, so it is destroyed in the manager thread
+        """
+        if wrapper is not None:
+            with self._lock:
+                self._retired.append(wrapper)
+
+    def _unhealthy(self, wrapper, now):
+        if now - wrapper.created_at > self._max_age:
+            return 'age'
+        if wrapper.loaded_contracts_num > self._max_loaded_contracts:
+            return 'loaded contracts'
+        requests, errors = self._last_counters.get(id(wrapper), (0, 0))
+        self._last_counters[id(wrapper)] = (wrapper.requests, wrapper.errors)
+        requests, errors = wrapper.requests - requests, wrapper.errors - errors
+        if requests >= self._min_requests and errors > self._max_error_rate * requests:
+            return 'error rate'
+        return None
+
+    def check(self):
+        """
+        Check all instances once and initialize replacements for unhealthy ones
+        """
+        with self._lock:
+            retired, self._retired = self._retired, []
+        # last references to replaced instances, tonlib clients are destroyed here
+        del retired
+        now = time.time()
+        workers = dict(self._client._workers)
+        recycle = [ident for ident, wrapper in workers.items() if self._unhealthy(wrapper, now)]
+        rss = process_rss()
+        if self._rss_baseline is None or rss < self._rss_baseline:
+            self._rss_baseline = rss
+        elif rss - self._rss_baseline > self._max_rss_growth and workers:
+            recycle.append(min(workers, key=lambda ident: workers[ident].created_at))
+            self._rss_baseline = rss
+        alive = {id(w) for w in workers.values()}
+        self._last_counters = {k: v for k, v in self._last_counters.items() if k in alive}
+        for ident in set(recycle):
+            if ident not in self._client._standby:
+                with self._client._lock:
+                    generation, config = self._client._config_generation, self._client.config
+                try:
+                    standby = self._client._create_standby(config)
+                except Exception:
+                    warnings.warn("Can't initialize replacement of tonlib instance", RuntimeWarning)
+                    traceback.print_exc()
+                    continue
+                self._client._park_standby(ident, generation, standby)
+
+    def _run(self):
+        while not self._stop.wait(self._check_interval):
+            try:
+                self.check()
+            except Exception:
+                warnings.warn("Tonlib instance check failed", RuntimeWarning)
+                traceback.print_exc()
@@ -0,0 +1,101 @@
+import asyncio
+import heapq
+import threading
+import time
+
+
+class AccessCounter:
+    """
+    Decaying access counters: every decay() multiplies all scores by `decay`, so top() reflects recent traffic.
+    """
+    def __init__(self, decay=0.5, max_tracked=10000, min_score=0.1):
+        self._decay = decay
+        self._max_tracked = max_tracked
+        self._min_score = min_score
+        self._scores = {}
+        self._lock = threading.Lock()
+
+    def touch(self, key):
+        with self._lock:
+            self._scores[key] = self._scores.get(key, 0) + 1
+            if len(self._scores) > 2 * self._max_tracked:
+                self._scores = dict(heapq.nlargest(self._max_tracked, self._scores.items(), key=lambda x: x[1]))
+
+    def decay(self):
+        with self._lock:
+            self._scores = {k: v * self._decay for k, v in self._scores.items() if v * self._decay >= self._min_score}
+
+    def top(self, n):
+        with self._lock:
+            return [k for k, _ in heapq.nlargest(n, self._scores.items(), key=lambda x: x[1])]
+
+
+class Prefetcher:
+    """
+    Keeps account states of the most requested addresses warm in the client cache: every `interval` seconds
+    states of `top` hottest addresses which were refreshed more than `refresh_age` seconds ago are
+    re-fetched in the background.
+
+    Budget: at most `budget` states per second are refreshed by at most `jobs` executor jobs, and only while
+    at least `reserved_threads` tonlib threads are not busy with foreground requests.
+    """
+    def __init__(self, client, top=100, interval=1.0, refresh_age=None, budget=20, jobs=1, reserved_threads=2,
+                 decay=0.5, decay_interval=60):
+        self._client = client
+        self._top = top
+        self._interval = interval
+        self._refresh_age = refresh_age
+        self._budget = budget
+        self._jobs = jobs
+        self._reserved_threads = reserved_threads
+        self._decay_interval = decay_interval
+        self.counter = AccessCounter(decay)
+        self._refreshed = {}
+        self._running_jobs = 0
+        self._task = None
+
+    def touch(self, address):
+        self.counter.touch(address)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _job_done(self, future):
+        self._running_jobs -= 1
+
+    def _candidates(self, now):
+        refresh_age = self._refresh_age if self._refresh_age is not None else self._client._account_state_ttl / 2
+        hot = self.counter.top(self._top)
+        self._refreshed = {a: self._refreshed[a] for a in hot if a in self._refreshed}
+        stale = [a for a in hot if now - self._refreshed.get(a, 0) >= refresh_age]
+        stale.sort(key=lambda a: self._refreshed.get(a, 0))
+        return stale[:max(int(self._budget * self._interval), 1)]
+
+    async def _run(self):
+        last_decay = time.monotonic()
+        while True:
+            await asyncio.sleep(self._interval)
+            now = time.monotonic()
+            if now - last_decay >= self._decay_interval:
+                self.counter.decay()
+                last_decay = now
+            idle_threads = self._client._threads - self._client._inflight
+            jobs = min(self._jobs - self._running_jobs, idle_threads - self._reserved_threads)
+            if jobs <= 0:
+                continue
+            addresses = self._candidates(now)
+            for i in range(jobs):
+                chunk = addresses[i::jobs]
+                if not chunk:
+                    break
+                for a in chunk:
+                    self._refreshed[a] = now
+                self._running_jobs += 1
+                self._client._refresh_account_states(chunk).add_done_callback(self._job_done)
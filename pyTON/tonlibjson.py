@@ -1,8 +1,11 @@
 import json
+import time
 from ctypes import *
 import platform
 import pkg_resources
 
+from .tracing import span
+
 def get_tonlib_path():
     arch_name = platform.system().lower()
     if arch_name == 'darwin':
@@ -45,18 +48,26 @@ class TonWrapper:
         tonlib_json_client_destroy.argtypes = [c_void_p]
         self._tonlib_json_client_destroy = tonlib_json_client_destroy
 
+        self.created_at = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.loaded_contracts_num = 0
 
     def __del__(self):
         self._tonlib_json_client_destroy(self._client)
 
     def ton_send(self, query):
-        query = json.dumps(query).encode('utf-8')
-        self._tonlib_json_client_send(self._client, query)
+        with span('ton_send.json_dumps'):
+            query = json.dumps(query).encode('utf-8')
+        with span('ton_send'):
+            self._tonlib_json_client_send(self._client, query)
 
     def ton_receive(self, timeout=10):
-        result = self._tonlib_json_client_receive(self._client, timeout)
+        with span('ton_receive'):
+            result = self._tonlib_json_client_receive(self._client, timeout)
         if result:
-            result = json.loads(result.decode('utf-8'))
+            with span('ton_receive.json_loads'):
+                result = json.loads(result.decode('utf-8'))
         return result
 
     def ton_exec(self, query, timeout=10):
@@ -64,4 +75,7 @@ class TonWrapper:
         result = None
         while (not isinstance(result, dict)) or (result['@type'] == 'updateSyncState'):
           result = self.ton_receive(timeout) 
+        self.requests += 1
+        if result['@type'] == 'error':
+          self.errors += 1
         return result
@@ -0,0 +1,132 @@
+import collections
+import contextvars
+import os
+import random
+import sys
+import threading
+import time
+
+current_trace = contextvars.ContextVar('pyTON_trace', default=None)
+
+
+class Trace:
+    __slots__ = ('name', 'started', 'start', 'duration', 'spans')
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.spans = []
+
+    def add(self, name, start, duration):
+        self.spans.append((name, start - self.start, duration))
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'started': self.started,
+            'duration': self.duration,
+            'spans': [{'name': name, 'start': start, 'duration': duration} for name, start, duration in self.spans]
+        }
+
+
+class span:
+    """
+    Context manager which records duration of the block to the trace of current request, if it is traced:
+
+        with span('ton_send'):
+            ...
+    """
+    __slots__ = ('name', 'trace', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.trace = current_trace.get()
+        if self.trace is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.trace is not None:
+            self.trace.add(self.name, self.start, time.perf_counter() - self.start)
+
+
+class Tracer:
+    """
+    Collects traces of requests: requests slower than `slow_threshold` seconds and `sample_rate` share of the
+    rest are kept in ring buffer of `buffer_size` traces.
+    """
+    def __init__(self, enabled=False, slow_threshold=0.5, sample_rate=0.01, buffer_size=1000):
+        self.enabled = enabled
+        self.slow_threshold = slow_threshold
+        self.sample_rate = sample_rate
+        self._traces = collections.deque(maxlen=buffer_size)
+
+    def start(self, name):
+        """
+        :return: token for finish() or None if tracing is disabled
+        """
+        if not self.enabled:
+            return None
+        trace = Trace(name)
+        return trace, current_trace.set(trace)
+
+    def finish(self, token):
+        if token is None:
+            return
+        trace, var_token = token
+        current_trace.reset(var_token)
+        trace.duration = time.perf_counter() - trace.start
+        if trace.duration >= self.slow_threshold or random.random() < self.sample_rate:
+            self._traces.append(trace)
+
+    def traces(self, min_duration=0):
+        return [t.to_dict() for t in list(self._traces) if t.duration >= min_duration]
+
+
+tracer = Tracer()
+
+
+def run_traced(trace, submitted, f, *args, **kwds):
+    """
+    Run f in executor thread within the trace of the request which submitted it.
+    """
+    start = time.perf_counter()
+    trace.add('executor_queue', submitted, start - submitted)
+    token = current_trace.set(trace)
+    try:
+        return f(*args, **kwds)
+    finally:
+        current_trace.reset(token)
+        trace.add('executor_job', start, time.perf_counter() - start)
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+def sample_stacks(seconds, interval=0.005):
+    """
+    Sampling profiler: every `interval` seconds during `seconds` stacks of all threads are recorded.
+    :return: str with folded stacks ("thread;outer;...;inner count" lines) accepted by flamegraph.pl and speedscope
+    """
+    own_thread = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    counts = collections.Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == own_thread:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            counts[';'.join(reversed(stack))] += 1
+        time.sleep(interval)
+    return ''.join('%s %d\n' % (stack, count) for stack, count in counts.most_common())
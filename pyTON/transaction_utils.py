@@ -0,0 +1,287 @@
+import codecs
+import sys
+
+from tvm_valuetypes.cell import deserialize_boc
+
+boc_magic_prefixes = (b'\xb5\xee\x9c\x72', b'\x68\xff\x65\xf3', b'\xac\xc3\xa7\x28')
+account_statuses = ('uninit', 'frozen', 'active', 'nonexist')
+
+
+def b64_to_bytes(b64str):
+    return codecs.decode(codecs.encode(b64str, 'utf-8'), 'base64')
+
+
+def read_uint(bits, offset, length):
+    return int.from_bytes(bits[offset:offset + length].tobytes(), 'big') >> (-length % 8)
+
+
+def decode_message_body(body):
+    """
+    Parse op code and text comment of message body.
+    :param body: bytes, either boc with body cell or body cell data as returned by old tonlib
+    :return: (op, comment), op is None for empty body, comment is None for non-text messages
+    """
+    if body[:4] in boc_magic_prefixes:
+        body = deserialize_boc(body).data.data.tobytes()
+    if len(body) < 4:
+        return None, None
+    op = int.from_bytes(body[:4], 'big')
+    if op != 0:
+        return op, None
+    return op, body[4:].decode('utf-8', 'replace')
+
+
+def decode_message(msg):
+    msg = dict(msg)
+    op, comment = None, None
+    try:
+        msg_data = msg.get('msg_data')
+        if msg_data and msg_data.get('@type') == 'msg.dataText':
+            op, comment = 0, b64_to_bytes(msg_data['text']).decode('utf-8', 'replace')
+        elif msg_data and msg_data.get('@type') == 'msg.dataRaw':
+            op, comment = decode_message_body(b64_to_bytes(msg_data['body']))
+        elif msg.get('message'):
+            op, comment = decode_message_body(b64_to_bytes(msg['message']))
+    except Exception:
+        pass
+    msg['op'], msg['comment'] = op, comment
+    return msg
+
+
+def decode_transaction(tx):
+    """
+    TLB:
+        transaction$0111 account_addr:bits256 lt:uint64 prev_trans_hash:bits256 prev_trans_lt:uint64 now:uint32
+          outmsg_cnt:uint15 orig_status:AccountStatus end_status:AccountStatus ... = Transaction;
+    :param tx: raw.transaction dict
+    :return: copy of tx with decoded header in 'decoded' and 'op', 'comment' in every message
+    """
+    tx = dict(tx)
+    if tx.get('in_msg'):
+        tx['in_msg'] = decode_message(tx['in_msg'])
+    tx['out_msgs'] = [decode_message(m) for m in tx.get('out_msgs', [])]
+    try:
+        bits = deserialize_boc(b64_to_bytes(tx['data'])).data.data
+        tx['decoded'] = {
+            'account': bits[4:260].tobytes().hex(),
+            'lt': read_uint(bits, 260, 64),
+            'prev_trans_hash': bits[324:580].tobytes().hex(),
+            'prev_trans_lt': read_uint(bits, 580, 64),
+            'now': read_uint(bits, 644, 32),
+            'outmsg_cnt': read_uint(bits, 676, 15),
+            'orig_status': account_statuses[read_uint(bits, 691, 2)],
+            'end_status': account_statuses[read_uint(bits, 693, 2)]
+        }
+    except Exception:
+        tx['decoded'] = None
+    return tx
+
+
+def decode_transactions(transactions):
+    """
+    Entry point for process pool workers: decode chunk of transactions at once.
+    """
+    return [decode_transaction(tx) for tx in transactions]
+
+
+_missing = object()
+
+
+def _compact_int(x):
+    # tonlib renders int64 as str, keep them as int until serialization
+    if isinstance(x, str) and x.lstrip('-').isdigit() and str(int(x)) == x:
+        return int(x)
+    return x
+
+
+def _render_int(x):
+    return str(x) if isinstance(x, int) else x
+
+
+def _intern(x):
+    return sys.intern(x) if isinstance(x, str) else x
+
+
+def _put(result, key, value):
+    if value is not _missing:
+        result[key] = value
+
+
+class CompactMessage:
+    """
+    raw.message with __slots__ instead of dict: int64 fields are stored as int, addresses are interned,
+    keys unknown to this class are kept in `extra`.
+    """
+    __slots__ = ('source', 'destination', 'value', 'fwd_fee', 'ihr_fee', 'created_lt', 'body_hash', 'message', 'extra')
+
+    def __init__(self, raw):
+        raw = dict(raw)
+        if raw.get('@type') == 'raw.message':
+            del raw['@type']
+        self.source = _intern(raw.pop('source', _missing))
+        self.destination = _intern(raw.pop('destination', _missing))
+        self.value = _compact_int(raw.pop('value', _missing))
+        self.fwd_fee = _compact_int(raw.pop('fwd_fee', _missing))
+        self.ihr_fee = _compact_int(raw.pop('ihr_fee', _missing))
+        self.created_lt = _compact_int(raw.pop('created_lt', _missing))
+        self.body_hash = raw.pop('body_hash', _missing)
+        self.message = raw.pop('message', _missing)
+        self.extra = raw or None
+
+    def to_dict(self):
+        result = {'@type': 'raw.message'}
+        _put(result, 'source', self.source)
+        _put(result, 'destination', self.destination)
+        _put(result, 'value', _render_int(self.value))
+        _put(result, 'fwd_fee', _render_int(self.fwd_fee))
+        _put(result, 'ihr_fee', _render_int(self.ihr_fee))
+        _put(result, 'created_lt', _render_int(self.created_lt))
+        _put(result, 'body_hash', self.body_hash)
+        _put(result, 'message', self.message)
+        if self.extra:
+            result.update(self.extra)
+        return result
+
+
+class CompactTransaction:
+    """
+    raw.transaction with __slots__ instead of dict, see CompactMessage.
+    Converted back to tonlib dict only at serialization time, see json_default.
+    """
+    __slots__ = ('utime', 'data', 'lt', 'hash', 'fee', 'storage_fee', 'other_fee', 'in_msg', 'out_msgs', 'extra')
+
+    def __init__(self, raw):
+        raw = dict(raw)
+        if raw.get('@type') == 'raw.transaction':
+            del raw['@type']
+        tx_id = raw.get('transaction_id')
+        if isinstance(tx_id, dict) and tx_id.get('@type') == 'internal.transactionId' and len(tx_id) == 3:
+            del raw['transaction_id']
+            self.lt, self.hash = _compact_int(tx_id['lt']), tx_id['hash']
+        else:
+            self.lt, self.hash = _missing, _missing
+        self.utime = raw.pop('utime', _missing)
+        self.data = raw.pop('data', _missing)
+        self.fee = _compact_int(raw.pop('fee', _missing))
+        self.storage_fee = _compact_int(raw.pop('storage_fee', _missing))
+        self.other_fee = _compact_int(raw.pop('other_fee', _missing))
+        in_msg = raw.pop('in_msg', _missing)
+        self.in_msg = CompactMessage(in_msg) if isinstance(in_msg, dict) else in_msg
+        out_msgs = raw.pop('out_msgs', _missing)
+        self.out_msgs = tuple(CompactMessage(m) for m in out_msgs) if isinstance(out_msgs, list) else out_msgs
+        self.extra = raw or None
+
+    def to_dict(self):
+        result = {'@type': 'raw.transaction'}
+        _put(result, 'utime', self.utime)
+        _put(result, 'data', self.data)
+        if self.lt is not _missing:
+            result['transaction_id'] = {'@type': 'internal.transactionId', 'lt': _render_int(self.lt), 'hash': self.hash}
+        _put(result, 'fee', _render_int(self.fee))
+        _put(result, 'storage_fee', _render_int(self.storage_fee))
+        _put(result, 'other_fee', _render_int(self.other_fee))
+        _put(result, 'in_msg', self.in_msg.to_dict() if isinstance(self.in_msg, CompactMessage) else self.in_msg)
+        _put(result, 'out_msgs', [m.to_dict() for m in self.out_msgs] if isinstance(self.out_msgs, tuple) else self.out_msgs)
+        if self.extra:
+            result.update(self.extra)
+        return result
+
+
+def json_default(obj):
+    """
+    `default` for json.dumps: compact records are converted to tonlib dicts one by one while being serialized.
+    """
+    if isinstance(obj, (CompactTransaction, CompactMessage)):
+        return obj.to_dict()
+    raise TypeError("Object of type %s is not JSON serializable" % type(obj).__name__)
+
+
+projection_fields = ('lt', 'hash', 'utime', 'fee', 'storage_fee', 'other_fee', 'data',
+                     'value', 'source', 'destination', 'in_msg', 'out_msgs')
+directions = ('in', 'out')
+
+
+def _msg_value(msg):
+    try:
+        return int(msg.get('value', 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def transaction_filter(direction=None, min_value=None):
+    """
+    :param direction: 'in' - transactions with internal incoming message, 'out' - transactions with outgoing messages
+    :param min_value: minimal value of incoming message (direction 'in'), of any outgoing message (direction 'out')
+      or of any of them (no direction)
+    :return: predicate for raw.transaction dicts or None if everything passes
+    """
+    if direction is None and min_value is None:
+        return None
+    if direction is not None and direction not in directions:
+        raise ValueError("Unknown direction %s" % direction)
+
+    def check(tx):
+        in_msg, out_msgs = tx.get('in_msg') or {}, tx.get('out_msgs') or []
+        incoming = [in_msg] if in_msg.get('source') else []
+        if direction == 'in':
+            candidates = incoming
+        elif direction == 'out':
+            candidates = out_msgs
+        else:
+            candidates = incoming + out_msgs
+        if not candidates:
+            return direction is None and min_value is None
+        return min_value is None or any(_msg_value(m) >= min_value for m in candidates)
+    return check
+
+
+def project_transaction(tx, fields, direction=None, min_value=None):
+    """
+    Build flat dict with requested fields of raw.transaction dict. value, source and destination are taken from
+    in_msg, or with direction 'out' are lists of them for outgoing messages which pass min_value, i.e. the
+    messages which transaction_filter(direction, min_value) matched on.
+    :param fields: iterable of projection_fields
+    """
+    in_msg = tx.get('in_msg') or {}
+    if direction == 'out':
+        out_msgs = [m for m in tx.get('out_msgs') or [] if min_value is None or _msg_value(m) >= min_value]
+    result = {}
+    for field in fields:
+        if field == 'lt':
+            result['lt'] = tx['transaction_id']['lt']
+        elif field == 'hash':
+            result['hash'] = tx['transaction_id']['hash']
+        elif field in ('value', 'source', 'destination'):
+            result[field] = [m.get(field) for m in out_msgs] if direction == 'out' else in_msg.get(field)
+        elif field == 'in_msg':
+            result['in_msg'] = tx.get('in_msg')
+        elif field == 'out_msgs':
+            result['out_msgs'] = tx.get('out_msgs', [])
+        else:
+            result[field] = tx.get(field)
+    return result
+
+
+flat_fields = ('lt', 'hash', 'utime', 'fee', 'storage_fee', 'other_fee',
+               'source', 'destination', 'value', 'out_msgs_count', 'out_value')
+
+
+def flat_transaction(tx):
+    """
+    Table row of raw.transaction dict: ids, fees, incoming message and totals of outgoing messages.
+    """
+    in_msg = tx.get('in_msg') or {}
+    out_msgs = tx.get('out_msgs') or []
+    return {
+        'lt': int(tx['transaction_id']['lt']),
+        'hash': tx['transaction_id']['hash'],
+        'utime': tx.get('utime'),
+        'fee': int(tx.get('fee', 0)),
+        'storage_fee': int(tx.get('storage_fee', 0)),
+        'other_fee': int(tx.get('other_fee', 0)),
+        'source': in_msg.get('source'),
+        'destination': in_msg.get('destination'),
+        'value': _msg_value(in_msg),
+        'out_msgs_count': len(out_msgs),
+        'out_value': sum(_msg_value(m) for m in out_msgs)
+    }
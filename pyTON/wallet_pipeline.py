@@ -0,0 +1,158 @@
+import asyncio
+import itertools
+import time
+
+from .wallet_utils import wallets as known_wallets, sha256
+
+
+class _Wallet:
+    __slots__ = ('address', 'seqno', 'last_transaction_id', 'lock', 'pending')
+
+    def __init__(self, address):
+        self.address = address
+        self.seqno = None
+        self.last_transaction_id = None
+        self.lock = asyncio.Lock()
+        self.pending = {}
+
+
+class WalletPipeline:
+    """
+    Outbound messages of wallets with locally tracked seqno.
+
+    submit() takes seqno from the local counter of the wallet and increments it optimistically, so concurrent
+    senders of one wallet get consecutive seqnos without asking liteserver; the counter is synced with the
+    wallet state on first use and after failures. Messages are broadcast with raw_send_message. One shared
+    loop polls states of wallets with pending messages: a message is confirmed when the wallet has a new
+    transaction and its on-chain seqno went past the message seqno, and expires if it did not happen in
+    `timeout` seconds. Statuses are 'sent', 'confirmed', 'failed' and 'expired'.
+    """
+    def __init__(self, client, poll_interval=1, timeout=60, retention=3600):
+        self._client = client
+        self._poll_interval = poll_interval
+        self._timeout = timeout
+        self._retention = retention
+        self._wallets = {}
+        self._messages = {}
+        self._ids = itertools.count(1)
+        self._task = None
+
+    async def _chain_seqno(self, wallet, state=None):
+        if state is None:
+            state = await self._client.raw_get_account_state(wallet.address, use_cache=False)
+        if state.get('@type') == 'error':
+            raise RuntimeError(state.get('message', "Can't get wallet state"))
+        code_hash = sha256(state.get('code', ''))
+        if code_hash in known_wallets:
+            info = {}
+            known_wallets[code_hash]['data_extractor'](info, state)
+            seqno = info['seqno']
+        elif state.get('code'):
+            r = await self._client.raw_run_method(wallet.address, 'seqno', [], use_cache=False)
+            if r.get('exit_code', 0) != 0 or not r.get('stack'):
+                raise RuntimeError("Can't get seqno of %s" % wallet.address)
+            seqno = int(r['stack'][0][1], 16)
+        else:
+            seqno = 0
+        return seqno, state.get('last_transaction_id')
+
+    async def submit(self, address, build_message):
+        """
+        :param address: wallet address
+        :param build_message: function (seqno) -> bytes or b64str with signed external message to the wallet
+        :return: message id for status() and wait()
+        """
+        address = self._client.prepare_address(address)
+        wallet = self._wallets.get(address)
+        if wallet is None:
+            wallet = self._wallets[address] = _Wallet(address)
+        msg_id = str(next(self._ids))
+        async with wallet.lock:
+            if wallet.seqno is None:
+                wallet.seqno, wallet.last_transaction_id = await self._chain_seqno(wallet)
+                if wallet.pending:
+                    # chain is behind messages which are sent but not included yet
+                    wallet.seqno = max(wallet.seqno, max(wallet.pending) + 1)
+            seqno = wallet.seqno
+            previous = wallet.pending.pop(seqno, None)
+            if previous is not None:
+                previous['status'], previous['error'] = 'failed', 'seqno %d is reused by message %s' % (seqno, msg_id)
+            boc = build_message(seqno)
+            msg = self._messages[msg_id] = {
+                'id': msg_id,
+                'address': address,
+                'seqno': seqno,
+                'hash': self._client._message_hash(boc).hex(),
+                'status': 'sent',
+                'sent_at': time.time()
+            }
+            try:
+                r = await self._client.raw_send_message(boc)
+            except Exception as e:
+                r = {'@type': 'error', 'message': str(e)}
+            if r.get('@type') == 'error':
+                msg['status'], msg['error'] = 'failed', r.get('message', '')
+                if not wallet.pending:
+                    # seqno may be wrong, resync before the next message; with pending messages the local
+                    # counter is kept since the chain seqno is behind them
+                    wallet.seqno = None
+            else:
+                wallet.seqno += 1
+                wallet.pending[seqno] = msg
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        return msg_id
+
+    def status(self, message_id):
+        """
+        :return: dict as {'id', 'address', 'seqno', 'hash', 'status', 'sent_at', 'error'} or None
+        """
+        return self._messages.get(message_id)
+
+    async def wait(self, message_id, timeout=None):
+        """
+        Wait until message is confirmed, failed or expired
+        """
+        started = time.monotonic()
+        while self._messages[message_id]['status'] == 'sent':
+            if timeout is not None and time.monotonic() - started > timeout:
+                break
+            await asyncio.sleep(self._poll_interval / 2)
+        return self._messages[message_id]
+
+    async def _check_wallet(self, wallet):
+        state = await self._client.raw_get_account_state(wallet.address, use_cache=False)
+        if state.get('@type') == 'error' or state.get('last_transaction_id') == wallet.last_transaction_id:
+            chain_seqno = None
+        else:
+            chain_seqno, wallet.last_transaction_id = await self._chain_seqno(wallet, state)
+        now = time.time()
+        async with wallet.lock:
+            for seqno, msg in list(wallet.pending.items()):
+                if chain_seqno is not None and seqno < chain_seqno:
+                    msg['status'] = 'confirmed'
+                elif now - msg['sent_at'] > self._timeout:
+                    msg['status'] = 'expired'
+                else:
+                    continue
+                del wallet.pending[seqno]
+            if chain_seqno is not None and (wallet.seqno is None or chain_seqno > wallet.seqno or not wallet.pending):
+                # somebody else used the wallet or our messages were lost
+                wallet.seqno = chain_seqno
+            elif not wallet.pending and wallet.seqno is not None and chain_seqno is None:
+                wallet.seqno = None
+
+    async def _run(self):
+        try:
+            while True:
+                await asyncio.sleep(self._poll_interval)
+                active = [w for w in self._wallets.values() if w.pending]
+                await asyncio.gather(*[self._check_wallet(w) for w in active], return_exceptions=True)
+                now = time.time()
+                for msg_id, msg in list(self._messages.items()):
+                    if msg['status'] != 'sent' and now - msg['sent_at'] > self._retention:
+                        del self._messages[msg_id]
+                if not self._messages:
+                    break
+        finally:
+            self._task = None
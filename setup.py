@@ -16,6 +16,9 @@ setup(
     version='0.1.4',
     packages=['pyTON'],
     install_requires=requirements,
+    extras_require={
+        'arrow': ['pyarrow']
+    },
     package_data={
         'pyTON': [
             'distlib/darwin/*',